@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Credential hub: pulls the access sheet from Google once for the whole fleet and
+serves it to the doors on the LAN, see nfc_door/credential_hub.py.
+
+    python3 Credential_Hub.py                       # Google Sheets from settings.toml
+    python3 Credential_Hub.py --csv sheet.csv       # serve a local CSV instead, for tests
+
+Doors use it by setting HUB_URL under [hub] in their settings.toml, and the
+same HUB_TOKEN as the hub.
+"""
+
+import argparse
+import toml
+from nfc_door.credential_hub import CredentialHub, make_server
+
+# Load settings from TOML file
+config = toml.load('settings.toml')
+HUB_PORT = config.get('hub', {}).get('HUB_PORT', 8080)
+HUB_HOST = config.get('hub', {}).get('HUB_HOST', '0.0.0.0')  # Address to listen on, e.g. the LAN address only
+HUB_TOKEN = config.get('hub', {}).get('HUB_TOKEN', '')  # Shared secret the doors must send
+PULL_INTERVAL = config['google_api'].get('SYNC_INTERVAL', 300)  # Seconds between Google Sheets downloads
+
+parser = argparse.ArgumentParser(description='Serve credential snapshots and deltas to the doors')
+parser.add_argument('--csv', help='serve this local verification sheet instead of Google Sheets')
+parser.add_argument('--host', default=HUB_HOST)
+parser.add_argument('--port', type=int, default=HUB_PORT)
+args = parser.parse_args()
+
+if args.csv:
+    # Function to read the stand-in sheet, it is read again every pull so edits show up at the doors
+    def fetch_rows():
+        with open(args.csv) as f:
+            return [line.strip().split(',') for line in f if line.strip()]
+    fetch_marker = None
+    PULL_INTERVAL = 2
+else:
+    from nfc_door.access_rules import merge_rule_columns
+    from nfc_door.sheets_client import SheetsClient, sheet_tab
+
+    SERVICE_ACCOUNT_FILE = config['google_api']['SERVICE_ACCOUNT_FILE']
+    SHEET_ID = config['google_api']['SHEET_ID']
+    RANGE = sheet_tab(config['google_api'])
+    TOKEN_CACHE = config['google_api'].get('TOKEN_CACHE', '.sheets_token.json')  # Google access token kept between restarts
+    sheets = SheetsClient(SERVICE_ACCOUNT_FILE, SHEET_ID, token_cache=TOKEN_CACHE)
+
+    # Function to download the access list from Google Sheets, with the schedule and expiry columns the doors need
+    def fetch_rows():
+        flags, rules = sheets.batch_get([f'{RANGE}!A:B', f'{RANGE}!F:G'])
+        return merge_rule_columns(flags, rules)
+
+    fetch_marker = sheets.file_version  # Only download the sheet after it was edited
+
+hub = CredentialHub(fetch_rows, interval=PULL_INTERVAL, fetch_marker=fetch_marker)
+hub.start()
+server = make_server(hub, host=args.host, port=args.port, token=HUB_TOKEN)
+if not HUB_TOKEN:
+    print('No HUB_TOKEN set, anyone who can reach the hub can read the access list')
+print(f'Serving credentials on {args.host} port {args.port}')
+try:
+    server.serve_forever()
+except KeyboardInterrupt:
+    pass
+finally:
+    server.server_close()
+    hub.stop()
@@ -7,47 +7,59 @@ import board
 import neopixel
 import toml
 from adafruit_pn532.uart import PN532_UART
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
-import smtplib
 import sys
+import threading
 import traceback
+from nfc_door.access_log import AccessLog
+from nfc_door.credential_index import CredentialIndex
+from nfc_door.door_sync import start_sync
+from nfc_door.relay import RelayScheduler
+from nfc_door.notifier import EmailNotifier
+from nfc_door.pn532_faults import FaultRecovery
+from nfc_door.startup import StartupTimer
+from nfc_door.tag_presence import PresenceTracker, TAG_DEPARTED
+from nfc_door.tap_trace import TapTrace, TraceWriter, LOOKUP_COMPLETE, DECISION, RELAY_ON, LED_UPDATE
+
+# Report how long each step of the startup took, the door authorizes from the local copy before Google is set up
+startup = StartupTimer()
 
 # Disable GPIO warnings
 GPIO.setwarnings(False)
 
 # Load settings from TOML file
 config = toml.load('settings.toml')
-SERVICE_ACCOUNT_FILE = config['google_api']['SERVICE_ACCOUNT_FILE']
-SHEET_ID = config['google_api']['SHEET_ID']
 SENDER_EMAIL = config['email']['SENDER_EMAIL']
 SENDER_PASSWORD = config['email']['SENDER_PASSWORD']
 RECEIVER_EMAIL = config['email']['RECEIVER_EMAIL']
-RANGE = config['google_api']['RANGE']
+ACCESS_LOG = config.get('door', {}).get('ACCESS_LOG', 'access_log.bin')  # Every access decision, see nfc_door/access_log.py
+TRACE_FILE = config.get('door', {}).get('TRACE_FILE', 'tap_traces.jsonl')  # Per-tap latency traces, one JSON object per line
 
-SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
-creds = service_account.Credentials.from_service_account_file(
-    SERVICE_ACCOUNT_FILE, scopes=SCOPES)
-
-service = build('sheets', 'v4', credentials=creds)
-
-# Define the Google Sheets document ID for the document you want to work with
-RANGE_NAME = (RANGE)'!A:B'
+# Define the local verification sheet file paths
 LOCAL_VERIFICATION_SHEET = 'local_verification_sheet.csv'
+LOCAL_CREDENTIAL_SNAPSHOT = 'local_verification_sheet.bin'  # Binary copy that loads without parsing
+LOCAL_ACCESS_RULES = 'local_access_rules.json'  # Compiled schedules and expiry dates
+
+# Load the local verification sheet into memory first, it is all the door needs to authorize
+credentials = CredentialIndex(LOCAL_VERIFICATION_SHEET, LOCAL_CREDENTIAL_SNAPSHOT, LOCAL_ACCESS_RULES)
+startup.mark(f'{len(credentials)} credentials loaded')
 
 # Set up NFC reader
 uart_reader = serial.Serial("/dev/ttyUSB0", baudrate=115200, timeout=0.1)
 pn532 = PN532_UART(uart_reader, debug=False)
 
-# PN532 reset function
-def pn532_reset():
-    pn532.reset()
-    pn532.SAM_configuration()
+# Reader faults are recovered with the cheapest fix that works, backing off when they repeat
+reader_faults = FaultRecovery(pn532, uart_reader)
+startup.mark('Reader ready')
 
 # Set up relay
 RELAY_PIN = 24
 GPIO.setmode(GPIO.BCM)
 GPIO.setup(RELAY_PIN, GPIO.OUT)
+UNLOCK_SECONDS = 5
+
+# Function to switch the relay on or off
+def set_relay(on):
+    GPIO.output(RELAY_PIN, GPIO.HIGH if on else GPIO.LOW)
 
 # Set up NeoPixel strip with brightness
 NUM_PIXELS = 7
@@ -58,125 +70,140 @@ pixels = neopixel.NeoPixel(PIXEL_PIN, NUM_PIXELS, brightness=0.15, auto_write=Fa
 BLUE = (0, 0, 255)
 GREEN = (0, 255, 0)
 RED = (255, 0, 0)
+pixel_lock = threading.Lock()  # The relay timer thread and the main loop both set the strip
 
 # Function to set NeoPixel color and display
 def set_neopixel_color(color):
-    pixels.fill(color)
-    pixels.show()
+    with pixel_lock:
+        pixels.fill(color)
+        pixels.show()
+
+# Function to show the resting color, green while the door is unlocked and blue otherwise
+def show_door_state():
+    set_neopixel_color(GREEN if relay.is_open else BLUE)
+
+# The relay is held open on a timer thread so the reader keeps running while the door is unlocked
+relay = RelayScheduler(set_relay, on_change=lambda is_open: show_door_state())
+
+# Emails are sent by a background worker that reuses one SMTP connection
+notifier = EmailNotifier(SENDER_EMAIL, SENDER_PASSWORD, RECEIVER_EMAIL)
 
-# Function to send an email notification
+# Access decisions are written to the SD card in groups by a background thread
+access_log = AccessLog(ACCESS_LOG)
+
+# Function to send an email notification, only queues the email so it never blocks the door
 def send_email(subject, body):
-    try:
-        server = smtplib.SMTP_SSL('smtp.gmail.com', 465)
-        server.login(SENDER_EMAIL, SENDER_PASSWORD)
-        message = f'Subject: {subject}\n\n{body}'
-        server.sendmail(SENDER_EMAIL, RECEIVER_EMAIL, message)
-        server.quit()
-    except Exception as e:
-        print(f'Failed to send email: {e}')
+    notifier.send(subject, body)
 
 # Function to handle unhandled exceptions and send an email notification
 def handle_exception(exc_type, exc_value, exc_traceback):
     error_message = ''.join(traceback.format_exception(exc_type, exc_value, exc_traceback))
     send_email('Error in Door Opener AI', f'The Door Opener AI encountered an unhandled exception:\n\n{error_message}')
+    notifier.close()  # Give the worker a chance to send it before the program exits
+    access_log.close()
 
-# Send email notification on program start and Raspberry Pi reboot
+# Send email notification on program start and Raspberry Pi reboot, the worker thread connects to the server
 send_email('Door Opener AI Started', 'The Door Opener AI program has started running.')
 
 # Set the global exception handler
 sys.excepthook = handle_exception
 
-# Download the Google Sheets document as a local verification sheet
-try:
-    result = service.spreadsheets().values().get(spreadsheetId=SHEET_ID, range=RANGE_NAME).execute()
-    values = result.get('values')
-    if values is not None:
-        with open(LOCAL_VERIFICATION_SHEET, 'w') as f:
-            for row in values:
-                f.write(','.join(row) + '\n')
-except Exception as e:
-    print(f'Error downloading Google Sheets: {e}')
+# Keep the verification sheet in step with Google Sheets (or the hub) and upload the access log in the background
+sheet_sync, access_upload = start_sync(config, credentials, startup=startup)
+
+# Track which tags are on the reader so a tag left there is only authorized once
+TAG_HOLD_OFF = 1.5  # Seconds a tag may go unread before it counts as removed
+presence = PresenceTracker(hold_off=TAG_HOLD_OFF)
+
+read_at = time.monotonic()  # When the last read finished, for the latency in the access log
+
+# Per-tap latency traces, read to lookup, decision, relay and LEDs, see nfc_door/tap_trace.py
+trace_writer = TraceWriter(TRACE_FILE)
+
+# Function to store an access decision in the trace and the access log, with the time it took since the tag was read
+def log_access(trace, decision):
+    trace.decision = decision
+    trace.mark(DECISION)
+    access_log.log(trace.uid, decision, '', (trace.marks[DECISION] - read_at) * 1000)
+    startup.mark('First authorization')
 
 # Main program loop
 print('Waiting for NFC tag...')
+startup.mark('Ready for tags')
 set_neopixel_color(BLUE)
-nfc_tag_detected = False  # Flag to track if NFC tag was detected
 nfc_issue_detected = False  # Flag to track if there's an NFC issue
-while True:
-    try:
-        uid = None
+# The relay is released and the GPIO pins reset however the loop ends, so a crash never leaves the door unlocked
+try:
+    while True:
         try:
             uid = pn532.read_passive_target(timeout=0.5)
+            read_at = time.monotonic()
+            reader_faults.succeeded()
             time.sleep(0.1)  # Add a 0.1-second delay between readings
-        except RuntimeError as e:
-            if 'Did not receive expected ACK from PN532!' in str(e):
-                print('Did not receive expected ACK from NFC tag. Retrying...')
-                continue
-            else:
-                raise
 
-        # Handle NFC tag detection
-        if uid is not None:
-            if not nfc_tag_detected:
+            # Handle NFC tag detection, a tag that stays on the reader is not looked up again
+            events = presence.update(uid)
+            for event, tag in events:
+                if event == TAG_DEPARTED:
+                    print('Tag removed')
+            uid = presence.arrival(events)
+            if uid is not None:
                 print('Tag detected')
-                nfc_tag_detected = True
-                set_neopixel_color(BLUE)  # Set strip to blue on tag detection
-
-            uid = ''.join(format(x, '02x') for x in uid)
-            print(f'Tag with UID {uid} detected')
-
-            # Check if tag is enrolled using local verification sheet
-            with open(LOCAL_VERIFICATION_SHEET, 'r') as f:
-                local_verification_data = f.readlines()
-            local_verification_data = [line.strip().split(',') for line in local_verification_data]
-            uids, enrolled = zip(*local_verification_data)
-            if uid not in uids:
-                print('This tag is not enrolled')
-                set_neopixel_color(RED)
-                time.sleep(2)
-                set_neopixel_color(BLUE)
-            else:
-                index = uids.index(uid)
-                if enrolled[index] == 'Y':
+                show_door_state()  # Set strip to its resting color on tag detection
+
+                uid = ''.join(format(x, '02x') for x in uid)
+                print(f'Tag with UID {uid} detected')
+
+                # Check if tag is enrolled using the in-memory verification index
+                trace = TapTrace(bytes.fromhex(uid), '', read_at)
+                credentials.refresh()
+                enrolled = credentials.lookup(uid)
+                trace.mark(LOOKUP_COMPLETE)
+                if enrolled is None:
+                    print('This tag is not enrolled')
+                    log_access(trace, 'not_enrolled')
+                    set_neopixel_color(RED)
+                    trace.mark(LED_UPDATE)
+                    trace_writer.write(trace)
+                    time.sleep(2)
+                    show_door_state()
+                elif enrolled == 'Y':
                     print('Access granted')
-                    set_neopixel_color(GREEN)  # Set strip to green when access is granted
-
-                    # Open relay
-                    GPIO.output(RELAY_PIN, GPIO.HIGH)
-                    time.sleep(5)
-                    # Close relay
-                    GPIO.output(RELAY_PIN, GPIO.LOW)
-
-                    set_neopixel_color(BLUE)  # Set strip back to blue after relay operation
+                    # Unlock without waiting, a grant while the door is open extends the window
+                    log_access(trace, 'granted')
+                    relay.unlock(UNLOCK_SECONDS)
+                    trace.mark(RELAY_ON)  # Handed to the relay thread, which switches it straight away
+                    trace_writer.write(trace)
                 else:
                     print('Access denied')
+                    log_access(trace, 'denied')
                     set_neopixel_color(RED)
+                    trace.mark(LED_UPDATE)
+                    trace_writer.write(trace)
                     time.sleep(2)
-                    set_neopixel_color(BLUE)
-        else:
-            # No NFC tag detected
-            nfc_tag_detected = False
-            set_neopixel_color(BLUE)  # Set strip back to blue
-
-    except RuntimeError as e:
-        if 'did not receive expected ACK from PN532' in str(e):
-            print('Did not receive expected ACK from NFC tag. Please try again.')
-            set_neopixel_color(RED)  # Set strip to flash red on NFC communication issues
-            nfc_issue_detected = True
-            pn532_reset()  # Reset the PN532
-        elif 'Response checksum did not match expected value' in str(e):
-            print('Move the tag closer to the NFC reader and try again.')
+                    show_door_state()
+            else:
+                # No new NFC tag detected
+                show_door_state()
+
+        except RuntimeError as e:
+            fault = reader_faults.handle(e)
+            if fault is None:
+                # Send email notification about the error
+                error_message = f'An error occurred in the NFC Reader:\n\n{str(e)}'
+                send_email('Error in NFC Reader', error_message)
+                raise  # Re-raise other RuntimeError exceptions
+            print(fault.hint)
             set_neopixel_color(RED)  # Set strip to flash red on NFC communication issues
             nfc_issue_detected = True
-            pn532_reset()  # Reset the PN532
-        else:
-            # Send email notification about the error
-            error_message = f'An error occurred in the NFC Reader:\n\n{str(e)}'
-            send_email('Error in NFC Reader', error_message)
-            raise  # Re-raise other RuntimeError exceptions
-
-    # Check if there's an NFC issue and reset the strip color after a while
-    if nfc_issue_detected:
-        time.sleep(0.5)  # Adjust this value to control the flashing speed
-        set_neopixel_color(BLUE)
-        time.sleep(0.5)
+
+        # Check if there's an NFC issue and reset the strip color after a while
+        if nfc_issue_detected:
+            time.sleep(0.5)  # Adjust this value to control the flashing speed
+            show_door_state()
+            time.sleep(0.5)
+            nfc_issue_detected = False
+finally:
+    relay.close()
+    GPIO.cleanup()
+    trace_writer.close()
@@ -7,39 +7,62 @@ import time
 import RPi.GPIO as GPIO
 import board
 import neopixel
-import smtplib
 import sys
+import threading
 import traceback
 from adafruit_pn532.uart import PN532_UART
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
+
+# Make the shared nfc_door package importable when run from this folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from nfc_door.access_log import AccessLog
+from nfc_door.credential_index import CredentialIndex
+from nfc_door.door_sync import start_sync
+from nfc_door.relay import RelayScheduler
+from nfc_door.notifier import EmailNotifier
+from nfc_door.pn532_autopoll import AutoPollReader
+from nfc_door.pn532_faults import FaultRecovery
+from nfc_door.startup import StartupTimer
+from nfc_door.tag_presence import PresenceTracker, TAG_DEPARTED
+from nfc_door.tap_trace import TapTrace, TraceWriter, LOOKUP_COMPLETE, DECISION, RELAY_ON, LED_UPDATE
+
+# Report how long each step of the startup took, the door authorizes from the local copy before Google is set up
+startup = StartupTimer()
 
 # Disable GPIO warnings
 GPIO.setwarnings(False)
 
-# Load settings from TOML file
-config = toml.load(os.path.join(os.path.dirname(__file__), 'settings.toml'))
+# Load settings from TOML file, the one next to this script or else the shared one in the folder above
+SETTINGS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'settings.toml')
+if not os.path.exists(SETTINGS_FILE):
+    SETTINGS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'settings.toml')
+config = toml.load(SETTINGS_FILE)
+ACCESS_LOG = config.get('door', {}).get('ACCESS_LOG', 'access_log.bin')  # Every access decision, see nfc_door/access_log.py
+TRACE_FILE = config.get('door', {}).get('TRACE_FILE', 'tap_traces.jsonl')  # Per-tap latency traces, one JSON object per line
 SENDER_EMAIL = config['email']['SENDER_EMAIL']
 SENDER_PASSWORD = config['email']['SENDER_PASSWORD']
 RECEIVER_EMAIL = config['email']['RECEIVER_EMAIL']
+DOOR_LOCATION = config['door']['DOOR_LOCATION']
 
 # Set up NFC reader
 uart_reader = serial.Serial("/dev/ttyUSB0", baudrate=115200, timeout=0.1)
 pn532 = PN532_UART(uart_reader, debug=False)
 
-# PN532 reset function
-def pn532_reset():
-    try:
-        pn532.reset()
-        time.sleep(1)  # Wait for the reset to complete
-        pn532.SAM_configuration()
-    except Exception as e:
-        print(f"Error during PN532 reset: {e}")
+# The PN532 looks for cards on its own (InAutoPoll) and the serial port is watched with select()
+reader = AutoPollReader(pn532, uart_reader)
+
+# Reader faults are recovered with the cheapest fix that works, backing off when they repeat
+reader_faults = FaultRecovery(reader, uart_reader)
+startup.mark('Reader ready')
 
 # Set up relay
 RELAY_PIN = 24
 GPIO.setmode(GPIO.BCM)
 GPIO.setup(RELAY_PIN, GPIO.OUT)
+UNLOCK_SECONDS = 5
+
+# Function to switch the relay on or off
+def set_relay(on):
+    GPIO.output(RELAY_PIN, GPIO.HIGH if on else GPIO.LOW)
 
 # Set up NeoPixel strip with brightness
 NUM_PIXELS = 7
@@ -50,27 +73,37 @@ pixels = neopixel.NeoPixel(PIXEL_PIN, NUM_PIXELS, brightness=0.15, auto_write=Fa
 BLUE = (0, 0, 255)
 GREEN = (0, 255, 0)
 RED = (255, 0, 0)
+pixel_lock = threading.Lock()  # The relay timer thread and the main loop both set the strip
 
 # Function to set NeoPixel color and display
 def set_neopixel_color(color):
-    pixels.fill(color)
-    pixels.show()
+    with pixel_lock:
+        pixels.fill(color)
+        pixels.show()
+
+# Function to show the resting color, green while the door is unlocked and blue otherwise
+def show_door_state():
+    set_neopixel_color(GREEN if relay.is_open else BLUE)
 
-# Function to send an email notification
+# The relay is held open on a timer thread so the reader keeps running while the door is unlocked
+relay = RelayScheduler(set_relay, on_change=lambda is_open: show_door_state())
+
+# Emails are sent by a background worker that reuses one SMTP connection
+notifier = EmailNotifier(SENDER_EMAIL, SENDER_PASSWORD, RECEIVER_EMAIL)
+
+# Access decisions are written to the SD card in groups by a background thread
+access_log = AccessLog(ACCESS_LOG)
+
+# Function to send an email notification, only queues the email so it never blocks the door
 def send_email(subject, body):
-    try:
-        server = smtplib.SMTP_SSL('smtp.gmail.com', 465)
-        server.login(SENDER_EMAIL, SENDER_PASSWORD)
-        message = f'Subject: {subject}\n\n{body}'
-        server.sendmail(SENDER_EMAIL, RECEIVER_EMAIL, message)
-        server.quit()
-    except Exception as e:
-        print(f'Failed to send email: {e}')
+    notifier.send(subject, body)
 
 # Function to handle unhandled exceptions and send an email notification
 def handle_exception(exc_type, exc_value, exc_traceback):
     error_message = ''.join(traceback.format_exception(exc_type, exc_value, exc_traceback))
     send_email(f'Error in {DOOR_LOCATION} Door Opener AI', f'The {DOOR_LOCATION} Door Opener AI encountered an unhandled exception:\n\n{error_message}')
+    notifier.close()  # Give the worker a chance to send it before the program exits
+    access_log.close()
 
 # Send email notification on program start and Raspberry Pi reboot
 send_email(f'{DOOR_LOCATION} Door Opener AI Started', f'The {DOOR_LOCATION} Door Opener AI program has started running.')
@@ -79,103 +112,113 @@ sys.excepthook = handle_exception
 
 # Define the local verification sheet file path
 LOCAL_VERIFICATION_SHEET = 'local_verification_sheet.csv'
+LOCAL_CREDENTIAL_SNAPSHOT = 'local_verification_sheet.bin'  # Binary copy that loads without parsing
+LOCAL_ACCESS_RULES = 'local_access_rules.json'  # Compiled schedules and expiry dates
+
+# Load the local verification sheet into memory, then keep it in step with Google Sheets (or the hub)
+# and upload the access log in the background
+credentials = CredentialIndex(LOCAL_VERIFICATION_SHEET, LOCAL_CREDENTIAL_SNAPSHOT, LOCAL_ACCESS_RULES)
+startup.mark(f'{len(credentials)} credentials loaded')
+sheet_sync, access_upload = start_sync(config, credentials, door=DOOR_LOCATION, startup=startup)
+
+# Track which tags are on the reader so a tag left there is only authorized once
+TAG_HOLD_OFF = 1.5  # Seconds a tag may go unread before it counts as removed
+presence = PresenceTracker(hold_off=TAG_HOLD_OFF)
+
+read_at = time.monotonic()  # When the last read finished, for the latency in the access log
+
+# Per-tap latency traces, read to lookup, decision, relay and LEDs, see nfc_door/tap_trace.py
+trace_writer = TraceWriter(TRACE_FILE)
+
+# Function to store an access decision in the trace and the access log, with the time it took since the tag was read
+def log_access(trace, decision):
+    trace.decision = decision
+    trace.mark(DECISION)
+    access_log.log(trace.uid, decision, DOOR_LOCATION, (trace.marks[DECISION] - read_at) * 1000)
+    startup.mark('First authorization')
 
 # Main program loop for NFC tag detection and door control
 print('Waiting for NFC tag...')
+startup.mark('Ready for tags')
 set_neopixel_color(BLUE)
-nfc_tag_detected = False  # Flag to track if NFC tag was detected
-nfc_issue_detected = False  # Flag to track if there's an NFC issue
-
-while True:
-    try:
-        for attempt in range(3):  # Try to read the NFC tag up to 3 times
-            uid = pn532.read_passive_target(timeout=1)
-            if uid is not None:
-                break
-            time.sleep(0.5)  # Wait a bit before retrying
-        else:
-            #print("Failed to read NFC tag after several attempts.")
-            continue
-
-        # NFC tag detected
-        if not nfc_tag_detected:
+restore_at = None  # When the strip goes back to its resting color after a fault flash
+
+# The relay is released and the GPIO pins reset however the loop ends, so a crash never leaves the door unlocked
+try:
+    while True:
+        try:
+            if restore_at is not None and time.monotonic() >= restore_at:
+                restore_at = None
+                show_door_state()
+            # Sleeps in select() until the PN532 reports a card, no polling from this side
+            timeout = 1 if restore_at is None else max(0.05, restore_at - time.monotonic())
+            uid = reader.read_passive_target(timeout=timeout)
+            read_at = time.monotonic()
+            reader_faults.succeeded()
+
+            # Only a tag that just arrived is authorized, one left on the reader gets no second relay pulse
+            events = presence.update(uid)
+            for event, tag in events:
+                if event == TAG_DEPARTED:
+                    print('Tag removed')
+            uid = presence.arrival(events)
+            if uid is None:
+                continue
+
+            # NFC tag detected
             print('Tag detected')
-            nfc_tag_detected = True
-            set_neopixel_color(BLUE)
-
-        uid = ''.join(format(x, '02x') for x in uid)
-        print(f'Tag with UID {uid} detected')
-
-        # Check if tag is enrolled
-        with open(LOCAL_VERIFICATION_SHEET, 'r') as f:
-            local_verification_data = f.readlines()
-        local_verification_data = [line.strip().split(',') for line in local_verification_data]
-        uids, enrolled = zip(*local_verification_data)
-
-        if uid not in uids:
-            print('Tag not enrolled')
-            set_neopixel_color(RED)
-            time.sleep(2)
-            set_neopixel_color(BLUE)
-            continue  # Tag not enrolled, continue scanning
-
-        index = uids.index(uid)
-        if enrolled[index] == 'Y':
-            print('Access granted')
-            set_neopixel_color(GREEN)
-
-            # Trigger relay
-            GPIO.output(RELAY_PIN, GPIO.HIGH)
-            time.sleep(5)  # Relay active for 5 seconds
-            GPIO.output(RELAY_PIN, GPIO.LOW)
-
-            set_neopixel_color(BLUE)
-        else:
-            print('Access denied')
-            set_neopixel_color(RED)
-            time.sleep(2)
-            set_neopixel_color(BLUE)
-    # Proceed if uid is not None...
-    except IndexError as e:
-        # Handle the specific 'index out of range' error gracefully
-        print("Encountered an IndexError, possibly due to unexpected NFC data format.")
-        # Consider adding a mechanism to log or further examine the erroneous data
-        continue  # Skip this loop iteration and try reading the tag again
-    except RuntimeError as e:
-        if 'did not receive expected ACK from PN532' in str(e):
-            print('Did not receive expected ACK from NFC tag. Please try again.')
-            set_neopixel_color(RED)
-            nfc_issue_detected = True
-            pn532_reset()
-        elif 'Did not receive expected ACK from PN532!' in str(e):
-            print('Did not receive expected ACK from NFC tag. Please try again.')
-            set_neopixel_color(RED)
-            nfc_issue_detected = True
-            pn532_reset()
-        elif 'Response checksum did not match expected value' in str(e):
-            print('Move the tag closer to the NFC reader and try again.')
-            set_neopixel_color(RED)
-            nfc_issue_detected = True
-            pn532_reset()
-        elif 'Response length checksum did not match length!' in str(e):
-            print('Checksum error. Resetting NFC reader...')
-            set_neopixel_color(RED)
-            nfc_issue_detected = True
-            pn532_reset()
-        else:
-            # Send email notification about the error
-            error_message = f'An error occurred in the NFC Reader:\n\n{str(e)}'
-            send_email('Error in NFC Reader', error_message)
-            raise  # Re-raise other RuntimeError exceptions
-        print(f'RuntimeError: {e}')
-        set_neopixel_color(RED)
-        nfc_issue_detected = True
-        pn532_reset()  # Attempt to reset the PN532 module
-        time.sleep(1)  # Wait a bit before continuing
-        set_neopixel_color(BLUE)
-        nfc_issue_detected = False
-        continue
-    # Add a brief delay before next loop iteration
-    time.sleep(0.5)
+            show_door_state()
+
+            uid = ''.join(format(x, '02x') for x in uid)
+            print(f'Tag with UID {uid} detected')
+
+            # Check if tag is enrolled, malformed sheet rows are skipped when the index loads
+            trace = TapTrace(bytes.fromhex(uid), DOOR_LOCATION, read_at)
+            credentials.refresh()
+            enrolled = credentials.lookup(uid)
+            trace.mark(LOOKUP_COMPLETE)
+
+            if enrolled is None:
+                print('Tag not enrolled')
+                log_access(trace, 'not_enrolled')
+                set_neopixel_color(RED)
+                trace.mark(LED_UPDATE)
+                trace_writer.write(trace)
+                time.sleep(2)
+                show_door_state()
+                continue  # Tag not enrolled, continue scanning
+
+            if enrolled == 'Y':
+                print('Access granted')
+                # Unlock without waiting, a grant while the door is open extends the window
+                log_access(trace, 'granted')
+                relay.unlock(UNLOCK_SECONDS)
+                trace.mark(RELAY_ON)  # Handed to the relay thread, which switches it straight away
+                trace_writer.write(trace)
+            else:
+                print('Access denied')
+                log_access(trace, 'denied')
+                set_neopixel_color(RED)
+                trace.mark(LED_UPDATE)
+                trace_writer.write(trace)
+                time.sleep(2)
+                show_door_state()
+        # Proceed if uid is not None...
+        except RuntimeError as e:
+            fault = reader_faults.handle(e)
+            if fault is None:
+                # Send email notification about the error
+                error_message = f'An error occurred in the NFC Reader:\n\n{str(e)}'
+                send_email('Error in NFC Reader', error_message)
+                raise  # Re-raise other RuntimeError exceptions
+            print(fault.hint)
+            set_neopixel_color(RED)  # Set strip to flash red on NFC communication issues
+            # Go back to the resting color shortly without holding up the reader
+            restore_at = time.monotonic() + 0.5
+            continue
+finally:
+    relay.close()
+    GPIO.cleanup()
+    trace_writer.close()
 
 # End of script
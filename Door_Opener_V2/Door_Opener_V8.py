@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+import os
+import toml
+import asyncio
+import sys
+import traceback
+
+# Make the shared nfc_door package importable when run from this folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from nfc_door.access_log import AccessLog
+from nfc_door.credential_index import CredentialIndex
+from nfc_door.door_sync import start_sync
+from nfc_door.door_controller import DoorController
+from nfc_door.notifier import EmailNotifier
+from nfc_door.startup import StartupTimer
+from nfc_door.tap_trace import TraceWriter
+from nfc_door.hardware import open_pn532, GPIORelay, open_neopixels, PixelSegment
+
+# Report how long each step of the startup took, the doors authorize from the local copy before Google is set up
+startup = StartupTimer()
+
+# Load settings from TOML file, the one next to this script or else the shared one in the folder above
+SETTINGS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'settings.toml')
+if not os.path.exists(SETTINGS_FILE):
+    SETTINGS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'settings.toml')
+config = toml.load(SETTINGS_FILE)
+SENDER_EMAIL = config['email']['SENDER_EMAIL']
+SENDER_PASSWORD = config['email']['SENDER_PASSWORD']
+RECEIVER_EMAIL = config['email']['RECEIVER_EMAIL']
+DOOR_LOCATION = config['door']['DOOR_LOCATION']
+TRACE_FILE = config['door'].get('TRACE_FILE', 'tap_traces.jsonl')  # Per-tap latency traces, one JSON object per line
+ACCESS_LOG = config['door'].get('ACCESS_LOG', 'access_log.bin')  # Every access decision, see nfc_door/access_log.py
+UART_CAPTURE = config['door'].get('UART_CAPTURE', '')  # Record the PN532 serial traffic here, empty to turn off
+
+# Define the local verification sheet file path
+LOCAL_VERIFICATION_SHEET = 'local_verification_sheet.csv'
+LOCAL_CREDENTIAL_SNAPSHOT = 'local_verification_sheet.bin'  # Binary copy that loads without parsing
+LOCAL_ACCESS_RULES = 'local_access_rules.json'  # Compiled schedules and expiry dates
+
+# Load the local verification sheet into memory first, it is all the doors need to authorize
+credentials = CredentialIndex(LOCAL_VERIFICATION_SHEET, LOCAL_CREDENTIAL_SNAPSHOT, LOCAL_ACCESS_RULES)
+startup.mark(f'{len(credentials)} credentials loaded')
+
+# Door bindings, each [[doors]] table in settings.toml is one reader, relay and LED segment
+# Without any the single door on /dev/ttyUSB0, relay pin 24 and the whole strip is used
+DOORS = config.get('doors') or [{'DOOR_LOCATION': DOOR_LOCATION, 'SERIAL_PORT': '/dev/ttyUSB0', 'RELAY_PIN': 24,
+                                 'LED_FIRST': 0, 'LED_COUNT': 7, 'UART_CAPTURE': UART_CAPTURE}]
+
+# Set up NeoPixel strip with brightness, long enough for every door's segment
+pixels = open_neopixels('D18', count=max(door['LED_FIRST'] + door['LED_COUNT'] for door in DOORS), brightness=0.15)
+
+# Set up one NFC reader and relay per door, each PN532 looks for cards on its own (InAutoPoll)
+# and its serial port is watched with select()
+for door in DOORS:
+    door['reader'], door['uart'] = open_pn532(door['SERIAL_PORT'], capture_path=door.get('UART_CAPTURE', ''))
+    door['relay'] = GPIORelay(door['RELAY_PIN'])
+    door['pixels'] = PixelSegment(pixels, door['LED_FIRST'], door['LED_COUNT'])
+startup.mark('Readers ready')
+
+# Emails are sent by a background worker that reuses one SMTP connection
+notifier = EmailNotifier(SENDER_EMAIL, SENDER_PASSWORD, RECEIVER_EMAIL)
+
+# Function to send an email notification, only queues the email so it never blocks the door
+def send_email(subject, body):
+    notifier.send(subject, body)
+
+# Function to handle unhandled exceptions and send an email notification
+def handle_exception(exc_type, exc_value, exc_traceback):
+    error_message = ''.join(traceback.format_exception(exc_type, exc_value, exc_traceback))
+    send_email(f'Error in {DOOR_LOCATION} Door Opener AI', f'The {DOOR_LOCATION} Door Opener AI encountered an unhandled exception:\n\n{error_message}')
+    notifier.close()  # Give the worker a chance to send it before the program exits
+
+# Set the global exception handler
+sys.excepthook = handle_exception
+
+# Keep the verification sheet in step with Google Sheets (or the hub) and upload the access log in the background
+sheet_sync, access_upload = start_sync(config, credentials, door=DOOR_LOCATION, startup=startup)
+
+# One controller per door, they share the credential index, the access log and the trace file
+trace_writer = TraceWriter(TRACE_FILE)
+access_log = AccessLog(ACCESS_LOG)
+controllers = []
+for i, door in enumerate(DOORS):
+    controllers.append(DoorController(door['reader'], credentials, door['relay'], door['pixels'], send_email,
+                                      uart=door['uart'], door_location=door['DOOR_LOCATION'], read_timeout=1,
+                                      refresh_interval=5 if i == 0 else None,  # One refresh is enough for the shared index
+                                      trace_writer=trace_writer, access_log=access_log, startup=startup))
+
+
+async def main():
+    # Send email notification on program start, it is only queued so the readers start right away
+    send_email(f'{DOOR_LOCATION} Door Opener AI Started', f'The {DOOR_LOCATION} Door Opener AI program has started running for: '
+               + ', '.join(door['DOOR_LOCATION'] for door in DOORS))
+    # Every reader is polled on its own thread, the decisions all run on this loop
+    await asyncio.gather(*(controller.run() for controller in controllers))
+
+
+try:
+    asyncio.run(main())
+finally:
+    for door in DOORS:
+        door['relay'](False)
+        door['uart'].close()  # Also flushes the UART capture
@@ -1,28 +1,34 @@
 #!/usr/bin/env python3
 
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
+import os
+import sys
+import toml
 
-SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
+# Make the shared nfc_door package importable when run from this folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from nfc_door.access_rules import merge_rule_columns
+from nfc_door.credential_index import write_verification_sheet
+from nfc_door.sheets_client import SheetsClient, sheet_tab
+
+# Load settings from TOML file
+config = toml.load('settings.toml')
 SERVICE_ACCOUNT_FILE = config['google_api']['SERVICE_ACCOUNT_FILE']
-creds = service_account.Credentials.from_service_account_file(
-    SERVICE_ACCOUNT_FILE, scopes=SCOPES)
+SHEET_ID = config['google_api']['SHEET_ID']
+RANGE = sheet_tab(config['google_api'])
+TOKEN_CACHE = config['google_api'].get('TOKEN_CACHE', '.sheets_token.json')  # Google access token kept between restarts
 
-service = build('sheets', 'v4', credentials=creds)
+sheets = SheetsClient(SERVICE_ACCOUNT_FILE, SHEET_ID, token_cache=TOKEN_CACHE)
 
-# Define the Google Sheets document ID for the document you want to work with
-SHEET_ID = ''
-RANGE_NAME = 'NFC-tags!A:B'
+# Define the Google Sheets range and the local file it is copied to
+RANGE_NAME = f'{RANGE}!A:B'
+RULES_RANGE = f'{RANGE}!F:G'  # Optional schedule and expiry date, see nfc_door/access_rules.py
 LOCAL_VERIFICATION_SHEET = 'local_verification_sheet.csv'
 
 # Download the Google Sheets document as a local verification sheet
 try:
-    result = service.spreadsheets().values().get(spreadsheetId=SHEET_ID, range=RANGE_NAME).execute()
-    values = result.get('values')
-    if values is not None:
-        with open(LOCAL_VERIFICATION_SHEET, 'w') as f:
-            for row in values:
-                f.write(','.join(row) + '\n')
+    values, rules = sheets.batch_get([RANGE_NAME, RULES_RANGE])
+    if values:
+        write_verification_sheet(LOCAL_VERIFICATION_SHEET, merge_rule_columns(values, rules))
 except Exception as e:
     # If there's an error downloading the sheet, continue with the existing local verification sheet if available
-    print(f'Error downloading Google Sheets: {e}')
\ No newline at end of file
+    print(f'Error downloading Google Sheets: {e}')
@@ -1,20 +1,25 @@
 import toml
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
 import time
 import serial
 from adafruit_pn532.uart import PN532_UART
+from nfc_door.enrollment_journal import EnrollmentJournal, ENROLL, apply_to_door_cache, replay_to_sheet
+from nfc_door.sheet_rows import SheetRowIndex
+from nfc_door.sheets_client import SheetsClient, sheet_tab
+from nfc_door.tag_presence import PresenceTracker
 
 # Load settings from TOML file
 config = toml.load('settings.toml')
 SERVICE_ACCOUNT_FILE = config['google_api']['SERVICE_ACCOUNT_FILE']
 SHEET_ID = config['google_api']['SHEET_ID']
+RANGE = sheet_tab(config['google_api'])
+BATCH_SIZE = config.get('enrollment', {}).get('BATCH_SIZE', 25)  # New tags uploaded in one append
+BATCH_SECONDS = config.get('enrollment', {}).get('BATCH_SECONDS', 10)  # Longest a new tag waits for its upload
+TOKEN_CACHE = config['google_api'].get('TOKEN_CACHE', '.sheets_token.json')  # Google access token kept between restarts
+JOURNAL_FILE = config.get('enrollment', {}).get('JOURNAL_FILE', 'enrollment_journal.jsonl')  # Changes not in Google Sheets yet
+DOOR_CACHE = config.get('enrollment', {}).get('DOOR_CACHE', 'local_verification_sheet.csv')  # Door on this Pi, empty to turn off
 
-SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
-
-creds = service_account.Credentials.from_service_account_file(
-    SERVICE_ACCOUNT_FILE, scopes=SCOPES)
-service = build('sheets', 'v4', credentials=creds)
+# Google Sheets API setup
+sheets = SheetsClient(SERVICE_ACCOUNT_FILE, SHEET_ID, token_cache=TOKEN_CACHE)
 
 # Set up NFC reader for UART connection
 # Replace '/dev/ttyUSB0' with the correct serial port if different
@@ -44,34 +49,78 @@ def read_nfc_tag():
         time.sleep(RETRY_DELAY)
     return None
 
-# Wait for NFC tag to be presented
-print('Waiting for NFC tag...')
-while True:
-    uid = read_nfc_tag()
-    if uid is None:
-        print('Failed to read NFC tag after multiple attempts')
-        continue
+# Every new tag goes to the journal first, so nothing is lost while Google Sheets can't be reached
+journal = EnrollmentJournal(JOURNAL_FILE)
+rows = SheetRowIndex(sheets, RANGE)
+
+# Function to upload the journal in a single append, tags that are in the sheet already are skipped
+def flush_pending():
+    count = len(journal.pending())
+    try:
+        replay_to_sheet(journal, rows)
+        print(f'{count} tags uploaded to Google Sheets')
+        return True
+    except Exception as e:
+        # Keep the journal, it is tried again later
+        print(f'Error uploading {count} tags to Google Sheets: {e}')
+        return False
+
+# Download the sheet once, after that duplicates are checked locally
+try:
+    rows.reload()
+    print(f'{len(rows.rows)} rows in Google Sheets')
+except Exception as e:
+    print(f'Google Sheets unreachable, enrolling offline: {e}')
+presence = PresenceTracker()
+flush_due = time.monotonic() if journal.pending() else None  # Upload what the last run left straight away
+retry_at = 0
 
-    uid = ''.join(format(x, '02x') for x in uid)
-    print(f'Tag with UID {uid} detected')
+# Function to let the door on this Pi in on the pending enrollments before they reach Google Sheets
+def update_door_cache():
+    if not DOOR_CACHE:
+        return
+    try:
+        added = apply_to_door_cache(journal, DOOR_CACHE)
+        if added:
+            print(f'{added} tags added to the door\'s local verification sheet')
+    except OSError as e:
+        print(f'Error updating the door\'s local verification sheet: {e}')
 
-    # Check if tag has been scanned before
-    range_name = 'Sheet1!A:B'
-    result = service.spreadsheets().values().get(spreadsheetId=SHEET_ID, range=range_name).execute()
-    values = result.get('values', [])
-    enrolled = ['Y' if row[1] == 'Y' else 'N' for row in values]
-    uids = [row[0] for row in values]
-    if uid in uids:
-        print('I have scanned this tag already')
-    else:
-        # Update Google Sheets with new record
-        values = [[uid, 'Y']]
-        body = {
-            'values': values
-        }
-        result = service.spreadsheets().values().append(spreadsheetId=SHEET_ID, range=range_name, valueInputOption='USER_ENTERED', insertDataOption='INSERT_ROWS', body=body).execute()
-        print('Record added to Google Sheets')
+update_door_cache()  # Tags the last run left in the journal
+
+# Function to check if a tag is in the sheet or waiting in the journal
+def is_known(uid):
+    return uid in rows or any(entry['uid'] == uid for entry in journal.pending())
+
+# Wait for NFC tags to be presented, new ones are uploaded every BATCH_SIZE tags or BATCH_SECONDS seconds
+print('Waiting for NFC tag...')
+try:
+    while True:
+        pending = len(journal.pending())
+        now = time.monotonic()
+        if pending and now >= retry_at and (pending >= BATCH_SIZE or now >= flush_due):
+            if flush_pending():
+                flush_due = None
+            else:
+                retry_at = now + BATCH_SECONDS
 
-    # Wait a bit before looking for another NFC tag
-    time.sleep(1)
+        # Only a tag that was just put on the reader counts, not one that is still lying there
+        uid = presence.arrival(presence.update(read_nfc_tag()))
+        if uid is None:
+            continue
 
+        uid = uid.hex()
+        if is_known(uid):
+            print(f'I have scanned tag {uid} already')
+            continue
+        journal.record(ENROLL, uid)
+        update_door_cache()
+        if flush_due is None:
+            flush_due = time.monotonic() + BATCH_SECONDS
+        print(f'Tag with UID {uid} queued ({len(journal.pending())} waiting for upload)')
+except KeyboardInterrupt:
+    print('Stopping')
+finally:
+    if journal.pending() and not flush_pending():
+        print(f'{len(journal.pending())} tags stay in {JOURNAL_FILE} and are uploaded on the next run')
+    journal.close()
@@ -1,21 +1,22 @@
 import toml
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
 import time
 import serial
 from adafruit_pn532.uart import PN532_UART
+from nfc_door.enrollment_journal import EnrollmentJournal, EDIT, replay_to_sheet
+from nfc_door.sheet_rows import SheetRowIndex
+from nfc_door.sheets_client import SheetsClient, sheet_tab
 
 # Load settings from TOML file
 config = toml.load('settings.toml')
 SERVICE_ACCOUNT_FILE = config['google_api']['SERVICE_ACCOUNT_FILE']
 SHEET_ID = config['google_api']['SHEET_ID']
-SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
-RANGE = config['google_api']['RANGE']
+RANGE = sheet_tab(config['google_api'])
+BATCH_SIZE = config.get('enrollment', {}).get('BATCH_SIZE', 25)  # Staged edits written in one batch update
+TOKEN_CACHE = config['google_api'].get('TOKEN_CACHE', '.sheets_token.json')  # Google access token kept between restarts
+JOURNAL_FILE = config.get('enrollment', {}).get('JOURNAL_FILE', 'enrollment_journal.jsonl')  # Changes not in Google Sheets yet
 
 # Google Sheets API setup
-creds = service_account.Credentials.from_service_account_file(
-    SERVICE_ACCOUNT_FILE, scopes=SCOPES)
-service = build('sheets', 'v4', credentials=creds)
+sheets = SheetsClient(SERVICE_ACCOUNT_FILE, SHEET_ID, token_cache=TOKEN_CACHE)
 
 # NFC reader setup
 uart = serial.Serial('/dev/ttyUSB0', baudrate=115200, timeout=0.5)
@@ -37,48 +38,73 @@ def read_nfc_tag():
         time.sleep(RETRY_DELAY)
     return None
 
-def find_row_by_uid(uid, values):
-    for i, row in enumerate(values):
-        if row[0] == uid:
-            return i + 1  # Spreadsheet rows are 1-indexed
-    return None
+# Local copy of the sheet, after the first download only new rows are fetched
+rows = SheetRowIndex(sheets, RANGE)
+try:
+    rows.reload()
+except Exception as e:
+    print(f'Google Sheets unreachable, editing offline: {e}')
+
+# Every edit goes to the journal first, edits left by the last run show up in the local copy again
+journal = EnrollmentJournal(JOURNAL_FILE)
+for entry in journal.pending():
+    if entry['op'] == EDIT:
+        rows.stage(entry['uid'], *entry['values'])
+
+# Function to write the journal to Google Sheets
+def commit_edits():
+    count = len(journal.pending())
+    if not count:
+        return
+    try:
+        missing = replay_to_sheet(journal, rows)
+    except Exception as e:
+        print(f'Error saving {count} changes to Google Sheets, they stay in {JOURNAL_FILE}: {e}')
+        return
+    for uid in missing:
+        print(f'UID {uid} is no longer in Google Sheets, its edit was dropped.')
+    print(f'{count - len(missing)} changes saved to Google Sheets.')
 
-def update_user_info(sheet_id, uid):
-    range_name = '(RANGE)!A:E'
-    result = service.spreadsheets().values().get(spreadsheetId=sheet_id, range=range_name).execute()
-    values = result.get('values', [])
-    
-    row_number = find_row_by_uid(uid, values)
-    if row_number:
-        row_data = values[row_number - 1]
-        if row_data[1] == 'Y':
+def update_user_info(uid):
+    try:
+        row_data = rows.row(uid)
+    except Exception as e:
+        print(f'Google Sheets unreachable and UID {uid} is not in the local copy: {e}')
+        return
+    if row_data:
+        if len(row_data) > 1 and row_data[1] == 'Y':
             if len(row_data) >= 5 and all(row_data[2:5]):  # Checks if C, D, E columns are filled
                 user_decision = input("The information has been filled out, would you like to change it? Y/N: ").strip().upper()
                 if user_decision != 'Y':
                     print("Update canceled by the user.")
                     return
-            
+
             last_name = input("Enter Last Name: ")
             first_name = input("Enter First Name: ")
             child = input("Enter Child: ")
-            body = {'values': [[uid, 'Y', last_name, first_name, child]]}
-            update_range = f'Sheet1!A{row_number}:E{row_number}'
-            service.spreadsheets().values().update(
-                spreadsheetId=SHEET_ID, range=update_range,
-                valueInputOption='USER_ENTERED', body=body).execute()
-            print("Information updated successfully.")
+            journal.record(EDIT, uid, [last_name, first_name, child])
+            rows.stage(uid, last_name, first_name, child)
+            print(f"Information staged, {len(journal.pending())} changes waiting. Press Ctrl+C to save and exit.")
+            if len(journal.pending()) >= BATCH_SIZE:
+                commit_edits()
         else:
             print("This tag is not enrolled. No update performed.")
     else:
         print("UID not found in Google Sheets.")
 
 print('Waiting for NFC tag...')
-while True:
-    uid = read_nfc_tag()
-    if uid is not None:
-        uid_hex = ''.join(format(x, '02x') for x in uid)
-        print(f'Tag with UID {uid_hex} detected')
-        update_user_info(SHEET_ID, uid_hex)
-    else:
-        print('Failed to read NFC tag')
-    time.sleep(1)
+try:
+    while True:
+        uid = read_nfc_tag()
+        if uid is not None:
+            uid_hex = ''.join(format(x, '02x') for x in uid)
+            print(f'Tag with UID {uid_hex} detected')
+            update_user_info(uid_hex)
+        else:
+            print('Failed to read NFC tag')
+        time.sleep(1)
+except KeyboardInterrupt:
+    print('Stopping')
+finally:
+    commit_edits()
+    journal.close()
@@ -4,6 +4,6 @@
 SCRIPT_PATH="/home/hunter/NFC_tag_door_opener/Door_Opener_V2/Door_Opener_V7.py"
 LOG_FILE="/home/hunter/door_opener.log"
 
-#open a new terminal window and run the python script
-/usr/bin/lxterminal -e "sudo /usr/bin/python3 $SCRIPT_PATH" >> $LOG_FILE 2>&1
-
+#open a new terminal window and run the python script, its own output is shown there and appended to the log
+#(redirecting lxterminal itself only captured the terminal's messages, not the script's)
+/usr/bin/lxterminal -e "bash -c 'sudo /usr/bin/python3 -u \"$SCRIPT_PATH\" 2>&1 | tee -a \"$LOG_FILE\"'"
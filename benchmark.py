@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the door hot path, run against simulated hardware.
+
+    python3 benchmark.py                  # everything, lookups up to 1,000,000 UIDs
+    python3 benchmark.py --max-uids 10000 --only lookup
+
+Reports tap-to-relay latency percentiles, sustained taps per minute, CPU
+seconds per idle hour of the door loop, and how the cost of one authorization
+grows with the size of the verification sheet for the dict index and the
+memory-mapped snapshot, and with a schedule and expiry date on every tag.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import tempfile
+import time
+
+from nfc_door.access_rules import compile_rules
+from nfc_door.credential_index import CredentialIndex
+from nfc_door.credential_snapshot import CredentialSnapshot, write_snapshot
+from nfc_door.door_controller import DoorController
+from nfc_door.hardware import SimulatedReader, SimulatedRelay, SimulatedPixels
+from nfc_door.tap_trace import RELAY_ON, DECISION
+
+
+class TraceCollector:
+    def __init__(self):
+        self.traces = []
+
+    def write(self, trace):
+        self.traces.append(trace)
+
+    def close(self):
+        pass
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return float('nan')
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def random_uids(count, seed=1):
+    rng = random.Random(seed)
+    uids = set()
+    while len(uids) < count:
+        uids.add(rng.randbytes(rng.choice((4, 7))))
+    return list(uids)
+
+
+# Run the controller until the reader has no more tags, with its output hidden
+def run_door(reader, credentials, unlock_seconds, settle=0.2, idle_seconds=None, read_timeout=0.05):
+    traces = TraceCollector()
+    relay = SimulatedRelay()
+    controller = DoorController(reader, credentials, relay, SimulatedPixels(),
+                                lambda subject, body: None, unlock_seconds=unlock_seconds,
+                                read_timeout=read_timeout, trace_writer=traces)
+
+    async def drive():
+        door = asyncio.create_task(controller.run())
+        if idle_seconds is not None:
+            await asyncio.sleep(idle_seconds)
+        while not reader.finished():
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(settle)
+        door.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await door
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        asyncio.run(drive())
+    return traces.traces, relay
+
+
+def bench_latency(taps, interval):
+    uids = random_uids(taps)
+    credentials = CredentialIndex()
+    credentials.swap({uid: 'Y' for uid in uids})
+    reader = SimulatedReader()
+    arrivals = {}
+    for i, uid in enumerate(uids):
+        at = 0.2 + i * interval
+        reader.add_tag(uid, at, hold=interval / 2)
+        arrivals[uid] = at
+
+    start = reader.clock() - reader.elapsed()
+    traces, _ = run_door(reader, credentials, unlock_seconds=interval / 4)
+    latencies = [(t.marks[RELAY_ON] - (start + arrivals[t.uid])) * 1000 for t in traces if t.has(RELAY_ON)]
+    return {
+        'taps': taps,
+        'measured': len(latencies),
+        'p50_ms': percentile(latencies, 50),
+        'p90_ms': percentile(latencies, 90),
+        'p99_ms': percentile(latencies, 99),
+        'max_ms': max(latencies) if latencies else float('nan'),
+    }
+
+
+def bench_throughput(seconds):
+    uids = random_uids(int(seconds * 200))
+    credentials = CredentialIndex()
+    credentials.swap({uid: 'Y' for uid in uids})
+    reader = SimulatedReader()
+    # Back to back cards, each only on the reader long enough for one read
+    for i, uid in enumerate(uids):
+        reader.add_tag(uid, 0.1 + i * 0.005, hold=0.005)
+
+    traces, _ = run_door(reader, credentials, unlock_seconds=0.01, settle=0.1)
+    decided = [t.marks[DECISION] for t in traces]
+    if len(decided) < 2:
+        return {'taps': len(decided), 'taps_per_minute': 0}
+    elapsed = max(decided) - min(decided)
+    return {'taps': len(decided), 'taps_per_minute': round(len(decided) / elapsed * 60)}
+
+
+def bench_idle_cpu(seconds):
+    reader = SimulatedReader()
+    cpu = time.process_time()
+    wall = time.monotonic()
+    # Same read timeout as Door_Opener_V8
+    run_door(reader, CredentialIndex(), unlock_seconds=5, settle=0, idle_seconds=seconds, read_timeout=1)
+    cpu = time.process_time() - cpu
+    wall = time.monotonic() - wall
+    return {'seconds': round(wall, 2), 'cpu_seconds_per_idle_hour': round(cpu / wall * 3600, 2)}
+
+
+def time_lookups(lookup, keys, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for key in keys:
+            lookup(key)
+        best = min(best, time.perf_counter() - start)
+    return best / len(keys) * 1e9
+
+
+def bench_lookup(max_uids, probes=20000):
+    results = []
+    size = 10
+    with tempfile.TemporaryDirectory() as tmp:
+        snapshot_path = os.path.join(tmp, 'bench.bin')
+        while size <= max_uids:
+            uids = random_uids(size, seed=size)
+            entries = {uid: 'Y' for uid in uids}
+            rng = random.Random(size)
+            hits = [rng.choice(uids) for _ in range(probes)]
+            misses = random_uids(probes, seed=-size)
+
+            index = CredentialIndex()
+            index.swap(entries)
+            write_snapshot(snapshot_path, entries)
+            mapped = CredentialIndex()
+            mapped.swap(CredentialSnapshot(snapshot_path))
+            # Every tag on a two-window schedule with an expiry date, compiled once and shared like at sync time
+            rule = next(iter(compile_rules([['00', 'Y', 'Mon-Fri 06:00-19:00; Sat 08:00-12:00', '2099-12-31']]).values()))
+            ruled = CredentialIndex()
+            ruled.swap(entries, {uid: rule for uid in uids})
+
+            results.append({
+                'uids': size,
+                'dict_hit_ns': round(time_lookups(index.lookup, hits)),
+                'dict_miss_ns': round(time_lookups(index.lookup, misses)),
+                'snapshot_hit_ns': round(time_lookups(mapped.lookup, hits)),
+                'snapshot_miss_ns': round(time_lookups(mapped.lookup, misses)),
+                'ruled_hit_ns': round(time_lookups(ruled.lookup, hits)),
+                'snapshot_bytes': os.path.getsize(snapshot_path),
+            })
+            size *= 10
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the door hot path with simulated hardware')
+    parser.add_argument('--only', choices=('latency', 'throughput', 'idle', 'lookup'), action='append')
+    parser.add_argument('--taps', type=int, default=200, help='taps for the latency run')
+    parser.add_argument('--max-uids', type=int, default=1_000_000, help='largest sheet for the lookup run')
+    parser.add_argument('--idle-seconds', type=float, default=5)
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+    selected = args.only or ['latency', 'throughput', 'idle', 'lookup']
+
+    results = {}
+    if 'latency' in selected:
+        results['latency'] = bench_latency(args.taps, interval=0.05)
+        r = results['latency']
+        print(f"tap to relay: p50 {r['p50_ms']:.2f} ms, p90 {r['p90_ms']:.2f} ms, "
+              f"p99 {r['p99_ms']:.2f} ms, max {r['max_ms']:.2f} ms ({r['measured']} taps)")
+    if 'throughput' in selected:
+        results['throughput'] = bench_throughput(seconds=2)
+        print(f"sustained: {results['throughput']['taps_per_minute']} taps per minute")
+    if 'idle' in selected:
+        results['idle'] = bench_idle_cpu(args.idle_seconds)
+        print(f"idle: {results['idle']['cpu_seconds_per_idle_hour']} CPU seconds per hour")
+    if 'lookup' in selected:
+        results['lookup'] = bench_lookup(args.max_uids)
+        print(f"{'uids':>9} {'dict hit':>9} {'dict miss':>9} {'mmap hit':>9} {'mmap miss':>9} {'rules hit':>9} "
+              f"{'mmap size':>10}")
+        for r in results['lookup']:
+            print(f"{r['uids']:>9} {r['dict_hit_ns']:>7}ns {r['dict_miss_ns']:>7}ns "
+                  f"{r['snapshot_hit_ns']:>7}ns {r['snapshot_miss_ns']:>7}ns {r['ruled_hit_ns']:>7}ns "
+                  f"{r['snapshot_bytes']:>10}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
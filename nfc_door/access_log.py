@@ -0,0 +1,120 @@
+"""
+Append-only log of access decisions.
+
+Every tap is stored as one small binary record: wall time in milliseconds,
+read-to-decision latency, the decision, the UID and the door. log() only
+appends the packed record to a list. A background thread writes everything
+collected since the last round with one write() and one fsync() (group
+commit), so the SD card never sits between a tag and the relay. At most
+commit_interval seconds of events are lost on a power cut.
+
+File layout: b'NFCA1' then records of
+
+    time_ms u64, latency_ms f32, decision u8, uid length u8, door length u8,
+    uid bytes, door bytes (utf-8)
+
+read_events() walks a file from a byte offset, so a reader can remember how
+far it got.
+
+    python3 -m nfc_door.access_log access_log.bin    # print every event
+"""
+
+import os
+import struct
+import sys
+import threading
+import time
+
+MAGIC = b'NFCA1'
+RECORD = struct.Struct('<QfBBB')
+
+# Same strings as door_controller.GRANTED, DENIED and NOT_ENROLLED
+DECISIONS = ('granted', 'denied', 'not_enrolled')
+_DECISION_CODES = {decision: code for code, decision in enumerate(DECISIONS, 1)}
+
+
+def pack_event(uid, decision, door='', latency_ms=0.0, at=None):
+    uid = bytes(uid)[:255]
+    door = door.encode()[:255]
+    time_ms = int((at if at is not None else time.time()) * 1000)
+    return RECORD.pack(time_ms, latency_ms, _DECISION_CODES.get(decision, 0), len(uid), len(door)) + uid + door
+
+
+# Yield (offset after the event, event dict) for every complete event from offset on
+def read_events(path, offset=0):
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'{path} is not an access log')
+        offset = max(offset, len(MAGIC))
+        f.seek(offset)
+        data = f.read()
+    position = 0
+    while position + RECORD.size <= len(data):
+        time_ms, latency_ms, code, uid_length, door_length = RECORD.unpack_from(data, position)
+        start = position + RECORD.size
+        end = start + uid_length + door_length
+        if end > len(data):
+            break  # Half written, the writer is not done yet
+        position = end
+        yield offset + position, {
+            'time': time_ms / 1000,
+            'uid': data[start:start + uid_length].hex(),
+            'door': data[start + uid_length:end].decode(errors='replace'),
+            'decision': DECISIONS[code - 1] if 0 < code <= len(DECISIONS) else 'unknown',
+            'latency_ms': round(latency_ms, 3),
+        }
+
+
+class AccessLog:
+    def __init__(self, path, commit_interval=1.0):
+        self.path = path
+        self.commit_interval = commit_interval
+        self.logged = 0
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        if os.fstat(self._fd).st_size == 0:
+            os.write(self._fd, MAGIC)
+            os.fsync(self._fd)
+        self._thread = threading.Thread(target=self._run, name='access log', daemon=True)
+        self._thread.start()
+
+    # Queue one access decision, only packs the record and appends it to a list
+    def log(self, uid, decision, door='', latency_ms=0.0):
+        record = pack_event(uid, decision, door, latency_ms)
+        with self._lock:
+            self._buffer.append(record)
+            self.logged += 1
+
+    # Write and fsync everything queued so far
+    def commit(self):
+        with self._lock:
+            records, self._buffer = self._buffer, []
+        if not records:
+            return
+        try:
+            os.write(self._fd, b''.join(records))
+            os.fsync(self._fd)
+        except OSError as e:
+            print(f'Error writing access log: {e}')
+
+    # Safe to call more than once, several door controllers can share one log
+    def close(self):
+        if self._fd is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self.commit()
+        os.close(self._fd)
+        self._fd = None
+
+    def _run(self):
+        while not self._stop.wait(self.commit_interval):
+            self.commit()
+
+
+if __name__ == '__main__':
+    for _, event in read_events(sys.argv[1]):
+        stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(event['time']))
+        print(f"{stamp} {event['door'] or '-'} {event['uid']} {event['decision']} {event['latency_ms']:.1f} ms")
@@ -0,0 +1,220 @@
+"""
+Schedules and expiry dates for enrolled tags, compiled once per sync.
+
+Two optional columns of the access sheet limit when an enrolled tag opens the
+door:
+
+    F  Schedule   Mon-Fri 06:00-19:00; Sat 08:00-12:00
+    G  Expires    2026-12-31 (to the end of that day) or 2026-12-31 18:00
+
+A schedule is a list of days or day ranges, each group followed by the time
+range it applies to: 'Mon Wed 08:00-09:00 Fri 12:00-13:00'. Groups may also be
+separated by ';', and a ',' counts as a space. The days or the times can be
+left out (every day, the whole day). Days are written like 'Mon' or 'Monday',
+times as 24 hour HH:MM, and any other word makes the schedule invalid. A time
+range that ends before it starts runs over midnight. compile_rules() turns the
+text into a sorted list of minute-of-week intervals per UID and the expiry as
+seconds since the epoch. Deciding a tap is then one dict lookup, a bisect and
+a comparison, without parsing any dates. A schedule or date that cannot be
+parsed keeps that tag out and is reported when the sheet is synced.
+
+Empty cells mean no limit, so a sheet without these columns works as before.
+The compiled table is saved as JSON next to the credential snapshot, so a
+restarted door has the rules without reading the CSV.
+"""
+
+import json
+import re
+import time
+from bisect import bisect_right
+from datetime import datetime, timedelta
+
+from nfc_door.atomic_file import atomic_write
+
+DAYS = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+DAY_NAMES = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+DAY_MINUTES = 24 * 60
+WEEK_MINUTES = 7 * DAY_MINUTES
+
+_minute_cache = (0.0, 0.0, 0)  # Start and end time of the last minute looked up, and its minute of the week
+
+
+# Minutes after midnight of 'HH:MM'
+def _minutes(text):
+    hours, minutes = text.split(':')
+    hours, minutes = int(hours), int(minutes)
+    if not (0 <= hours <= 24 and 0 <= minutes < 60) or hours * 60 + minutes > DAY_MINUTES:
+        raise ValueError(f'bad time {text!r}')
+    return hours * 60 + minutes
+
+
+# Day number (Monday is 0) of 'Mon' or 'Monday', None for any other word
+def _day(text):
+    text = text.lower()
+    if text in DAYS:
+        return DAYS.index(text)
+    if text in DAY_NAMES:
+        return DAY_NAMES.index(text)
+    return None
+
+
+# Day numbers (Monday is 0) of 'Mon', 'Mon-Fri' or 'Fri-Mon', None if the word is not a day
+def _days(text):
+    ends = [_day(name) for name in text.split('-')]
+    if len(ends) > 2 or None in ends:
+        return None
+    first, last = ends[0], ends[-1]
+    return [(first + i) % 7 for i in range((last - first) % 7 + 1)]
+
+
+# Compile schedule text into (starts, ends), sorted and merged minute-of-week intervals
+def parse_schedule(text):
+    intervals = []
+    for item in text.split(';'):
+        words = re.sub(r'\s*-\s*', '-', item).replace(',', ' ').split()
+        days = []  # Days read since the last time range, it applies to them
+        for word in words:
+            if re.fullmatch(r'\d{1,2}:\d{2}-\d{1,2}:\d{2}', word):
+                if not days and len(words) > 1:
+                    raise ValueError(f'no days in front of {word!r}')
+                start_text, end_text = word.split('-')
+                start, end = _minutes(start_text), _minutes(end_text)
+                if end <= start:
+                    end += DAY_MINUTES  # Over midnight
+                for day in days or range(7):
+                    intervals.append((day * DAY_MINUTES + start, day * DAY_MINUTES + end))
+                days = []
+            else:
+                word_days = _days(word)
+                if word_days is None:
+                    raise ValueError(f'{word!r} is neither a day nor a time range like 08:00-17:00')
+                days.extend(word_days)
+        # Days without a time range are open the whole day
+        for day in days:
+            intervals.append((day * DAY_MINUTES, (day + 1) * DAY_MINUTES))
+    if not intervals:
+        raise ValueError('empty schedule')
+
+    # Sunday night runs into Monday morning
+    wrapped = []
+    for start, end in intervals:
+        if end > WEEK_MINUTES:
+            wrapped.append((start, WEEK_MINUTES))
+            wrapped.append((0, end - WEEK_MINUTES))
+        else:
+            wrapped.append((start, end))
+    merged = []
+    for start, end in sorted(wrapped):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return tuple(start for start, _ in merged), tuple(end for _, end in merged)
+
+
+# Seconds since the epoch a tag stops working, from '2026-12-31', '2026-12-31 18:00' or a Sheets date number
+def parse_expiry(text):
+    text = text.strip()
+    try:
+        # A date typed into Sheets comes back as days since 1899-12-30
+        days = float(text)
+    except ValueError:
+        days = None
+    if days is not None:
+        expiry = datetime(1899, 12, 30) + timedelta(days=days)
+        if days.is_integer():
+            expiry += timedelta(days=1)
+    else:
+        for layout in ('%Y-%m-%d %H:%M', '%Y-%m-%d'):
+            try:
+                expiry = datetime.strptime(text, layout)
+                break
+            except ValueError:
+                continue
+        else:
+            raise ValueError(f'bad date {text!r}')
+        if layout == '%Y-%m-%d':
+            expiry += timedelta(days=1)
+    return time.mktime(expiry.timetuple())
+
+
+# Build {uid bytes: (starts, ends, expires)} from sheet rows [uid, enrolled, schedule, expires]
+def compile_rules(rows):
+    rules = {}
+    schedules = {}  # Schedule text -> compiled intervals, most tags share a few schedules
+    seen = set()
+    for row in rows:
+        try:
+            key = bytes.fromhex(row[0].strip()) if len(row) >= 2 else None
+        except ValueError:
+            continue
+        # The first row of a UID wins, like for the enrolled flag
+        if not key or key in seen:
+            continue
+        seen.add(key)
+        if len(row) < 3 or not any(cell.strip() for cell in row[2:4]):
+            continue
+        schedule = row[2].strip()
+        expiry = row[3].strip() if len(row) > 3 else ''
+        try:
+            if schedule and schedule not in schedules:
+                schedules[schedule] = parse_schedule(schedule)
+            starts, ends = schedules[schedule] if schedule else (None, None)
+            expires = parse_expiry(expiry) if expiry else None
+        except (ValueError, OverflowError) as e:
+            print(f'Keeping tag {row[0].strip()} out, its schedule or expiry date is wrong: {e}')
+            starts, ends, expires = (), (), None
+        rules[key] = (starts, ends, expires)
+    return rules
+
+
+# Minute of the week (Monday 00:00 is 0) at time now, localtime() only runs once a minute
+def week_minute(now):
+    global _minute_cache
+    start, end, minute = _minute_cache
+    if start <= now < end:
+        return minute
+    t = time.localtime(now)
+    minute = t.tm_wday * DAY_MINUTES + t.tm_hour * 60 + t.tm_min
+    start = now - t.tm_sec - now % 1
+    _minute_cache = (start, start + 60, minute)
+    return minute
+
+
+# True if a rule lets its tag in at time now
+def rule_allows(rule, now):
+    starts, ends, expires = rule
+    if expires is not None and now >= expires:
+        return False
+    if starts is None:
+        return True
+    minute = week_minute(now)
+    i = bisect_right(starts, minute) - 1
+    return i >= 0 and minute < ends[i]
+
+
+# Add the schedule and expiry columns (F:G) to the enrolled rows (A:B) downloaded next to them
+def merge_rule_columns(rows, rule_rows):
+    merged = []
+    for i, row in enumerate(rows):
+        extra = rule_rows[i] if i < len(rule_rows) else []
+        if any(cell.strip() for cell in extra):
+            # The local verification sheet is a plain CSV, so no commas in the cells. A comma in a schedule only
+            # separates days or groups, which a space does as well
+            extra = [cell.replace(',', ' ') for cell in extra] + [''] * (2 - len(extra))
+            row = (row + [''] * (2 - len(row)))[:2] + extra[:2]
+        merged.append(row)
+    return merged
+
+
+def save_rules(path, rules):
+    compiled = {key.hex(): [None if starts is None else list(starts), None if ends is None else list(ends), expires]
+                for key, (starts, ends, expires) in rules.items()}
+    atomic_write(path, json.dumps(compiled, separators=(',', ':')))
+
+
+def load_rules(path):
+    with open(path) as f:
+        compiled = json.load(f)
+    return {bytes.fromhex(uid): (None if starts is None else tuple(starts), None if ends is None else tuple(ends), expires)
+            for uid, (starts, ends, expires) in compiled.items()}
@@ -0,0 +1,125 @@
+"""
+Background upload of the access log to a tab of the Google Sheet.
+
+AccessUploader reads the events the door wrote to its AccessLog and appends
+them to the log tab in batches of up to batch_size rows, one append
+per batch, from a background thread every interval seconds. The door loop
+never waits for it.
+
+How far the upload got (the high-water mark) is a byte offset into the
+access log, kept in a small JSON file next to it together with the last row
+of the tab the uploader wrote. Before a batch is sent the mark file notes the
+offset the batch ends at; after the append it moves the mark there. If the
+append failed or the process died in between, the uploader reads the ID
+column below the last row it wrote, so only the rows appended since, not the
+whole history. Every row carries '<source>:<inode>:<offset>' as its ID, so
+the uploader can tell whether that batch made it and upload it again only if
+it did not. The inode keeps the IDs of a replaced log file apart.
+"""
+
+import json
+import os
+import re
+import socket
+import threading
+import time
+
+from nfc_door.access_log import read_events
+from nfc_door.atomic_file import atomic_write
+
+
+# Last row number of an A1 range like 'Log!A120:F150', as in the answer to an append
+def last_row(cell_range):
+    match = re.search(r'(\d+)$', cell_range)
+    return int(match.group(1)) if match else None
+
+
+# Turn an access log event into a row for the log tab
+def event_row(event, event_id):
+    stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(event['time']))
+    return [stamp, event['door'], event['uid'], event['decision'], event['latency_ms'], event_id]
+
+
+class AccessUploader:
+    def __init__(self, append_rows, fetch_ids, log_path, mark_path=None, source=None,
+                 interval=60, batch_size=1000):
+        self.append_rows = append_rows  # Appends a list of rows to the log tab, returns the last row it wrote or None
+        self.fetch_ids = fetch_ids  # Returns the ID column of the log tab from a row down, only used after a failure
+        self.log_path = log_path
+        self.mark_path = mark_path or f'{log_path}.uploaded'
+        self.source = source or socket.gethostname()  # Keeps IDs apart when several doors share the tab
+        self.interval = interval
+        self.batch_size = batch_size
+        self.uploaded = 0
+        self.last_upload = None  # time.time() of the last successful upload
+        self._mark = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _load_mark(self):
+        try:
+            with open(self.mark_path) as f:
+                mark = json.load(f)
+        except (OSError, ValueError):
+            mark = {}
+        # A new access log file starts from the beginning again
+        if mark.get('ino') != os.stat(self.log_path).st_ino:
+            mark = {'ino': os.stat(self.log_path).st_ino, 'offset': 0, 'row': mark.get('row')}
+        if 'pending' in mark:
+            # Only the rows below the last one this uploader wrote can hold the batch
+            first_row = (mark.get('row') or 0) + 1
+            if self._event_id(mark['ino'], mark['pending']) in set(self.fetch_ids(first_row)):
+                mark['offset'] = mark['pending']
+            del mark['pending']
+            self._save_mark(mark)
+        return mark
+
+    def _event_id(self, ino, offset):
+        return f'{self.source}:{ino}:{offset}'
+
+    def _save_mark(self, mark):
+        atomic_write(self.mark_path, json.dumps(mark))
+        self._mark = mark
+
+    # Upload everything logged since the high-water mark, returns the number of rows sent
+    def upload_once(self):
+        sent = 0
+        try:
+            if self._mark is None:
+                self._mark = self._load_mark()
+            while True:
+                rows = []
+                end = self._mark['offset']
+                for end, event in read_events(self.log_path, self._mark['offset']):
+                    rows.append(event_row(event, self._event_id(self._mark['ino'], end)))
+                    if len(rows) >= self.batch_size:
+                        break
+                if not rows:
+                    break
+                self._save_mark(dict(self._mark, pending=end))
+                row = self.append_rows(rows)
+                self._save_mark({'ino': self._mark['ino'], 'offset': end, 'row': row})
+                sent += len(rows)
+        except FileNotFoundError:
+            pass  # Nothing logged yet
+        except Exception as e:
+            print(f'Error uploading access log to Google Sheets: {e}')
+            self._mark = None  # Sort out a half finished batch on the next try
+        if sent:
+            self.uploaded += sent
+            self.last_upload = time.time()
+        return sent
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='access upload', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.upload_once()
+            self._stop.wait(self.interval)
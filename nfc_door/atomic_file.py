@@ -0,0 +1,31 @@
+"""
+Replace a file in one step.
+
+atomic_write() writes the new contents to a temp file next to the target,
+fsyncs it and renames it over the target, so a reader or a power cut only
+ever sees the old or the new file. The temp file is named after the process
+and thread, so two writers of the same file never write into each other's.
+"""
+
+import os
+import threading
+
+
+# Replace path with data (str or bytes), permissions apply when the file is created
+def atomic_write(path, data, permissions=0o666):
+    if isinstance(data, str):
+        data = data.encode()
+    tmp_path = f'{path}.{os.getpid()}-{threading.get_ident()}.tmp'
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, permissions)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
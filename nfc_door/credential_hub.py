@@ -0,0 +1,423 @@
+"""
+Credential distribution hub for a fleet of doors.
+
+One machine runs the hub: it pulls the access sheet (from Google or any other
+fetch_rows) and numbers every version that differs from the one before. The
+doors ask the hub instead of Google over plain HTTP on the LAN:
+
+    GET /snapshot           {"revision": r, "published": t, "rows": [[uid, enrolled, schedule, expires], ...]}
+    GET /delta?since=r0     {"revision": r, "published": t, "since": r0,
+                             "changed": [[uid, enrolled, schedule, expires], ...], "removed": [uid, ...]}
+                            410 if r0 is too old
+    POST /pull              pull the sheet now, e.g. from an Apps Script onEdit trigger
+    GET /status             what every door reported: revision, latency, last seen
+
+Both answers carry ETag "r". A door that sends If-None-Match with the revision
+it already has gets an empty 304, so an idle fleet costs a few bytes per poll.
+With &wait=seconds a delta request that has nothing new is held open (long
+poll) and answered the moment a new version is published, so a revoked card
+reaches every door well under a second after the hub sees it. The door passes
+&door=, &applied= and &latency= with its next request, which is how /status
+knows the publish-to-applied latency of every door. The schedule and expiry
+cells (see access_rules.py) are left out of a row when both are empty, so a
+row may also be just [uid, enrolled]. That latency compares the
+hub's and the door's wall clocks, so both need NTP.
+
+The snapshot is the whole access list, so with a token every request must
+carry 'Authorization: Bearer <token>' or is answered 401. The doors send it
+with HubSync(token=), an Apps Script trigger has to add the header to its
+POST /pull.
+
+With fetch_marker (Drive's version number of the sheet) the hub only
+downloads the sheet when the marker moved since the last pull.
+
+The hub keeps the deltas of the last max_deltas versions. Revisions start at
+the hub's start time in milliseconds, so after a hub restart no door mistakes
+an old revision number for a new one; those doors get a 410 and fetch a
+snapshot.
+
+HubSync is the door side. It has the same start(), stop(), sync_once() and
+last_sync as SheetSync and applies the rows to a CredentialIndex.
+"""
+
+import hmac
+import json
+import math
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, urlencode
+
+
+# Turn sheet rows into an ordered {uid: [enrolled, schedule, expires]} dict, the first row of a UID wins like at the door
+# Empty cells at the end are dropped, so a tag without a schedule or expiry date has just [enrolled]
+def rows_to_entries(rows):
+    entries = {}
+    for row in rows:
+        if len(row) < 2 or not row[0].strip():
+            continue
+        cells = [cell.strip() for cell in row[1:4]]
+        while len(cells) > 1 and not cells[-1]:
+            cells.pop()
+        entries.setdefault(row[0].strip().lower(), cells)
+    return entries
+
+
+# Turn sheet rows into an ordered {uid: enrolled} dict
+def rows_to_dict(rows):
+    return {uid: cells[0] for uid, cells in rows_to_entries(rows).items()}
+
+
+class CredentialHub:
+    def __init__(self, fetch_rows, interval=60, max_deltas=100, fetch_marker=None):
+        self.fetch_rows = fetch_rows
+        self.fetch_marker = fetch_marker  # Returns a marker that changes with every edit, e.g. SheetsClient.file_version()
+        self._marker = None
+        self.interval = interval
+        self.max_deltas = max_deltas
+        self.revision = int(time.time() * 1000)
+        self.last_pull = None  # time.time() of the last successful pull
+        self._entries = None
+        self._deltas = []  # (revision, changed dict, removed set), oldest first
+        self._snapshot_body = None
+        self.published = None  # time.time() the current revision was published
+        self.doors = {}  # Door name -> what it reported with its last request
+        self._lock = threading.Lock()
+        self._published_event = threading.Condition(self._lock)
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+
+    # Pull the sheet once, returns True if it changed
+    def pull_once(self):
+        marker = None
+        if self.fetch_marker is not None:
+            try:
+                marker = self.fetch_marker()
+            except Exception as e:
+                print(f'Error checking Google Sheets for changes: {e}')
+                if getattr(e, 'status', None) == 403:
+                    self.fetch_marker = None  # Most likely the Drive API is not enabled, download every time
+            if marker is not None and marker == self._marker:
+                self.last_pull = time.time()
+                return False
+        try:
+            rows = self.fetch_rows()
+        except Exception as e:
+            print(f'Error downloading Google Sheets: {e}')
+            return False
+        if not rows:
+            print('Google Sheets returned no rows, keeping the current credentials')
+            return False
+        self._marker = marker
+        self.last_pull = time.time()
+        return self.publish(rows_to_entries(rows))
+
+    # Make entries the newest version if they differ from the current one
+    def publish(self, entries):
+        with self._lock:
+            old = self._entries
+            if entries == old:
+                return False
+            self.revision += 1
+            if old is not None:
+                changed = {uid: cells for uid, cells in entries.items() if old.get(uid) != cells}
+                removed = set(old) - set(entries)
+                self._deltas.append((self.revision, changed, removed))
+                del self._deltas[:-self.max_deltas]
+            self._entries = entries
+            self.published = time.time()
+            self._snapshot_body = json.dumps({'revision': self.revision, 'published': self.published,
+                                              'rows': [[uid] + cells for uid, cells in entries.items()]},
+                                             separators=(',', ':')).encode()
+            # Answer the doors that are waiting in a long poll
+            self._published_event.notify_all()
+            return True
+
+    def snapshot(self):
+        with self._lock:
+            return self.revision, self._snapshot_body
+
+    # Everything that changed after revision since, or None if that is too far back
+    # With wait, hold on up to that many seconds for a newer revision when since is current
+    def delta(self, since, wait=0):
+        with self._lock:
+            if wait and since == self.revision:
+                self._published_event.wait_for(lambda: self.revision != since, timeout=wait)
+            if self._entries is None:
+                return self.revision, None
+            if since == self.revision:
+                changed, removed = {}, set()
+            elif not self._deltas or not self._deltas[0][0] - 1 <= since < self.revision:
+                return self.revision, None
+            else:
+                changed = {}
+                removed = set()
+                for revision, delta_changed, delta_removed in self._deltas:
+                    if revision <= since:
+                        continue
+                    for uid in delta_removed:
+                        changed.pop(uid, None)
+                        removed.add(uid)
+                    for uid, cells in delta_changed.items():
+                        removed.discard(uid)
+                        changed[uid] = cells
+            body = {'revision': self.revision, 'published': self.published, 'since': since,
+                    'changed': [[uid] + cells for uid, cells in changed.items()], 'removed': sorted(removed)}
+            return self.revision, json.dumps(body, separators=(',', ':')).encode()
+
+    # Record what a door reported with its request
+    def report(self, door, revision=None, latency_ms=None):
+        with self._lock:
+            status = self.doors.setdefault(door, {'revision': None, 'latency_ms': None, 'max_latency_ms': None})
+            status['seen'] = time.time()
+            if revision is not None:
+                status['revision'] = revision
+            if latency_ms is not None:
+                status['latency_ms'] = latency_ms
+                status['max_latency_ms'] = max(status['max_latency_ms'] or 0, latency_ms)
+
+    def status(self):
+        with self._lock:
+            doors = {door: dict(status) for door, status in self.doors.items()}
+            return {'revision': self.revision, 'published': self.published, 'last_pull': self.last_pull, 'doors': doors}
+
+    # Pull the sheet now instead of at the next interval
+    def request_pull(self):
+        self._wake.set()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='hub pull', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.pull_once()
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+
+class _HubHandler(BaseHTTPRequestHandler):
+    hub = None
+    token = ''
+    max_wait = 60
+
+    # True if the request carries the shared token, or no token is set; answers 401 otherwise
+    def _authorized(self):
+        if not self.token:
+            return True
+        given = self.headers.get('Authorization', '')
+        if hmac.compare_digest(given.encode(), f'Bearer {self.token}'.encode()):
+            return True
+        self.send_response(401)
+        self.send_header('WWW-Authenticate', 'Bearer')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+        return False
+
+    def do_POST(self):
+        if not self._authorized():
+            return
+        if urlparse(self.path).path != '/pull':
+            self.send_error(404)
+            return
+        self.hub.request_pull()
+        self.send_response(202)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        if not self._authorized():
+            return
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if 'door' in query:
+            self._report(query)
+
+        if url.path == '/status':
+            self._send_json(json.dumps(self.hub.status()).encode())
+            return
+        if url.path == '/snapshot':
+            revision, body = self.hub.snapshot()
+        elif url.path == '/delta':
+            try:
+                since = int(query['since'][0])
+                wait = float(query.get('wait', ['0'])[0])
+            except (KeyError, ValueError):
+                self.send_error(400, 'delta needs ?since=<revision>')
+                return
+            # nan would make the long poll wait forever
+            if not (math.isfinite(wait) and wait >= 0):
+                self.send_error(400, 'wait must be a number of seconds')
+                return
+            wait = min(wait, self.max_wait)
+            revision, body = self.hub.delta(since, wait)
+            if body is None:
+                self.send_error(410, 'revision too old, fetch /snapshot')
+                return
+        else:
+            self.send_error(404)
+            return
+        if body is None:
+            self.send_error(503, 'no credentials pulled yet')
+            return
+
+        etag = f'"{revision}"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self._send_json(body, etag)
+
+    def _report(self, query):
+        try:
+            revision = int(query['applied'][0]) if 'applied' in query else None
+            latency_ms = float(query['latency'][0]) if 'latency' in query else None
+        except ValueError:
+            return
+        self.hub.report(query['door'][0], revision, latency_ms)
+
+    def _send_json(self, body, etag=None):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if etag is not None:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    # The doors poll all the time, keep the console for errors
+    def log_message(self, format, *args):
+        pass
+
+
+# Serve a hub over HTTP, returns the server, call serve_forever() on it
+# With a token only requests that send it are answered, see the top of this file
+def make_server(hub, host='0.0.0.0', port=8080, token=''):
+    handler = type('HubHandler', (_HubHandler,), {'hub': hub, 'token': token})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True  # Doors waiting in a long poll must not hold up a shutdown
+    return server
+
+
+class HubSync:
+    def __init__(self, base_url, credentials, interval=10, timeout=5, long_poll=25, door='', token=''):
+        self.base_url = base_url.rstrip('/')
+        self.credentials = credentials
+        self.token = token  # Shared secret the hub was started with, empty if it has none
+        self.interval = interval  # Seconds between polls, or before retrying after an error with long_poll
+        self.timeout = timeout
+        self.long_poll = long_poll  # Seconds the hub may hold a request open, 0 for plain polling
+        self.door = door or socket.gethostname()  # Name the hub's /status shows for this door
+        self.revision = None
+        self.last_sync = None  # time.time() of the last successful sync
+        self.last_latency_ms = None  # Hub publish to applied here, for the last change
+        self.max_latency_ms = None
+        self.revoked = 0
+        self._entries = None
+        self._report = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _get(self, path, wait=0):
+        query = dict(self._report)
+        if wait:
+            query['wait'] = wait
+        query['door'] = self.door
+        if query:
+            path += ('&' if '?' in path else '?') + urlencode(query)
+        request = urllib.request.Request(self.base_url + path)
+        if self.token:
+            request.add_header('Authorization', f'Bearer {self.token}')
+        if self.revision is not None:
+            request.add_header('If-None-Match', f'"{self.revision}"')
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout + wait) as response:
+                body = json.load(response)
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                return None
+            raise
+        self._report = {}
+        return body
+
+    # Ask the hub for what changed and apply it, returns True if the door is up to date
+    def sync_once(self):
+        try:
+            body = None
+            if self._entries is not None:
+                try:
+                    body = self._get(f'/delta?since={self.revision}', self.long_poll)
+                    if body is None:
+                        self.last_sync = time.time()
+                        return True
+                    entries = dict(self._entries)
+                    for uid in body['removed']:
+                        entries.pop(uid, None)
+                    entries.update((row[0], row[1:]) for row in body['changed'])
+                except urllib.error.HTTPError as e:
+                    if e.code != 410:
+                        raise
+                    body = None
+            if body is None:
+                self.revision = None
+                body = self._get('/snapshot')
+                entries = {row[0]: row[1:] for row in body['rows']}
+        except Exception as e:
+            print(f'Error syncing credentials from the hub: {e}')
+            return False
+
+        revoked = self._count_revoked(entries)
+        # Swaps the in-memory index first, the local files are written after
+        # The schedule and expiry cells come along, so the door keeps its access rules
+        self.credentials.update([[uid] + cells for uid, cells in entries.items()], revision=body['revision'])
+        self._applied(body, revoked)
+        self._entries = entries
+        self.revision = body['revision']
+        self.last_sync = time.time()
+        return True
+
+    # Tags that were allowed in before and are not any more
+    def _count_revoked(self, entries):
+        if self._entries is None:
+            return 0
+        return sum(1 for uid, cells in self._entries.items() if cells[0] == 'Y' and entries.get(uid, [''])[0] != 'Y')
+
+    # Measure how long the change took from the hub to here, and tell the hub with the next request
+    def _applied(self, body, revoked):
+        latency_ms = None
+        if self._entries is not None and body.get('published'):
+            latency_ms = round((time.time() - body['published']) * 1000, 1)
+            self.last_latency_ms = latency_ms
+            self.max_latency_ms = max(self.max_latency_ms or 0, latency_ms)
+        self._report = {'applied': body['revision']}
+        if latency_ms is not None:
+            self._report['latency'] = latency_ms
+        if revoked:
+            self.revoked += revoked
+            print(f'Revoked {revoked} tags, {latency_ms} ms after the hub published the change')
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='hub sync', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.is_set():
+            # With long polling the next request goes out straight away, the hub holds it until something changes
+            if not self.sync_once() or not self.long_poll:
+                self._stop.wait(self.interval)
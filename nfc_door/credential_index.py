@@ -0,0 +1,188 @@
+"""
+In-memory index of the local verification sheet.
+
+The door scripts used to reopen and split the whole CSV on every tap. The index
+keeps the UIDs in a dict keyed by the raw UID bytes and only re-reads the file
+when its inode, mtime or size changes.
+
+With a snapshot_path the index is backed by a binary CredentialSnapshot
+instead. A restarted door then maps the snapshot and authorizes its first tap
+without parsing the CSV, which is only read when it is newer than the snapshot.
+
+Rows may carry a schedule and an expiry date after the enrolled flag, see
+nfc_door/access_rules.py. They are compiled when the rows are loaded, and
+lookup() answers 'N' for an enrolled tag outside its schedule or after its
+expiry. With a rules_path the compiled rules are saved next to the snapshot
+and loaded with it.
+"""
+
+import os
+import threading
+import time
+
+from nfc_door.access_rules import compile_rules, load_rules, rule_allows, save_rules
+from nfc_door.atomic_file import atomic_write
+from nfc_door.credential_snapshot import CredentialSnapshot, write_snapshot
+
+
+# Convert a UID given as a hex string or as bytes from the PN532 into dict key bytes
+def uid_key(uid):
+    if isinstance(uid, str):
+        try:
+            return bytes.fromhex(uid.strip())
+        except ValueError:
+            return None
+    return bytes(uid)
+
+
+# Build a {uid bytes: enrolled flag} dict from sheet rows, skipping malformed rows
+def build_entries(rows):
+    entries = {}
+    for row in rows:
+        if len(row) < 2:
+            continue
+        key = uid_key(row[0])
+        if not key:
+            continue
+        # The old linear search matched the first occurrence, keep that behaviour
+        entries.setdefault(key, row[1].strip())
+    return entries
+
+
+# Write rows to the local verification sheet, replacing the old file in one step
+def write_verification_sheet(path, rows):
+    atomic_write(path, ''.join(','.join(row) + '\n' for row in rows))
+
+
+# Identify a version of a file by inode, mtime and size, None if it does not exist
+def _file_signature(path):
+    if path is None:
+        return None
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+class CredentialIndex:
+    def __init__(self, path=None, snapshot_path=None, rules_path=None):
+        self.path = path
+        self.snapshot_path = snapshot_path
+        self.rules_path = rules_path
+        self._entries = {}
+        self._rules = {}  # UID bytes -> compiled schedule and expiry, only for tags that have one
+        self._signature = None
+        self._lock = threading.Lock()  # refresh() and update() run on different threads
+        if path is not None or snapshot_path is not None:
+            self.refresh()
+
+    # Reload the files if they changed since the last load, returns True on reload
+    # A tap does not wait while update() is writing the files, the update swaps in the new entries itself
+    def refresh(self):
+        if not self._lock.acquire(blocking=False):
+            return False
+        try:
+            return self._refresh()
+        finally:
+            self._lock.release()
+
+    def _refresh(self):
+        csv_signature = _file_signature(self.path)
+        snapshot_signature = _file_signature(self.snapshot_path)
+        if (csv_signature, snapshot_signature) == self._signature:
+            return False
+
+        entries = None
+        if snapshot_signature and (csv_signature is None or snapshot_signature[1] >= csv_signature[1]):
+            try:
+                entries = CredentialSnapshot(self.snapshot_path)
+                rules = self._load_rules()
+            except (OSError, ValueError) as e:
+                print(f'Ignoring unreadable credential snapshot: {e}')
+                entries = None
+        if entries is None:
+            if csv_signature is None:
+                return False
+            entries, rules = self._load_csv()
+
+        self.swap(entries, rules)
+        self.mark_current()
+        return True
+
+    # Parse the CSV, and write a snapshot of it so the next start does not have to
+    def _load_csv(self):
+        with open(self.path, 'r') as f:
+            rows = [line.strip().split(',') for line in f]
+        entries = build_entries(rows)
+        rules = compile_rules(rows)
+        if self.snapshot_path is not None:
+            try:
+                if self.rules_path is not None:
+                    save_rules(self.rules_path, rules)
+                write_snapshot(self.snapshot_path, entries)
+                entries = CredentialSnapshot(self.snapshot_path)
+            except OSError as e:
+                print(f'Error writing credential snapshot: {e}')
+        return entries, rules
+
+    # The compiled rules that go with the snapshot, compiled from the CSV if they were never saved
+    def _load_rules(self):
+        if self.rules_path is not None:
+            try:
+                return load_rules(self.rules_path)
+            except FileNotFoundError:
+                pass
+        if _file_signature(self.path) is None:
+            return {}
+        with open(self.path, 'r') as f:
+            return compile_rules(line.strip().split(',') for line in f)
+
+    # Store freshly downloaded sheet rows on disk and swap them in
+    def update(self, rows, revision=None):
+        entries = build_entries(rows)
+        rules = compile_rules(rows)
+        with self._lock:
+            self.swap(entries, rules)  # A revoked tag stops working now, not after the files are written
+            try:
+                if self.path is not None:
+                    write_verification_sheet(self.path, rows)
+                if self.rules_path is not None:
+                    save_rules(self.rules_path, rules)
+                if self.snapshot_path is not None:
+                    write_snapshot(self.snapshot_path, entries, revision)
+                    entries = CredentialSnapshot(self.snapshot_path)
+            except OSError as e:
+                print(f'Error writing local verification sheet: {e}')
+            self.swap(entries, rules)
+            self.mark_current()
+
+    # Replace all entries at once, readers see either the old or the new entries
+    # The rules go first, so a tag that just got a schedule is never let in without it
+    def swap(self, entries, rules=None):
+        if rules is not None:
+            self._rules = rules
+        self._entries = entries
+
+    # Remember the files as they are now, after their contents were already swapped in
+    def mark_current(self):
+        self._signature = (_file_signature(self.path), _file_signature(self.snapshot_path))
+
+    # Return the enrolled flag for a UID ('Y', 'N', ...) or None if it is unknown
+    # An enrolled tag outside its schedule or after its expiry date gets 'N'
+    def lookup(self, uid):
+        key = uid_key(uid)
+        if key is None:
+            return None
+        flag = self._entries.get(key)
+        if flag == 'Y' and self._rules:
+            rule = self._rules.get(key)
+            if rule is not None and not rule_allows(rule, time.time()):
+                return 'N'
+        return flag
+
+    def __contains__(self, uid):
+        return self.lookup(uid) is not None
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,96 @@
+"""
+Binary snapshot of the verification sheet that can be used without parsing.
+
+Layout, all little endian:
+
+    header   magic b'NFCS', version (u8), uid width (u8), reserved (u16),
+             record count (u32), sheet revision (u64)
+    records  uid length (u8), uid padded with zeros to the uid width,
+             flags (u8), sorted by the first two fields
+
+A 7 byte UID takes 9 bytes, so a million tags is about 9 MB. The file is
+written to a temp file and renamed into place, and read through mmap with a
+binary search, so a restarted door can look up its first tag straight away.
+"""
+
+import bisect
+import mmap
+import struct
+import time
+
+from nfc_door.atomic_file import atomic_write
+
+MAGIC = b'NFCS'
+VERSION = 1
+HEADER = struct.Struct('<4sBBHIQ')
+
+# Flag bits stored with each UID
+FLAG_ENROLLED = 0x01
+
+
+# Build the sort key of a record from the UID bytes
+def _record_key(uid, width):
+    return bytes([len(uid)]) + uid.ljust(width, b'\0')
+
+
+# Write {uid bytes: enrolled flag} entries to a snapshot file, replacing the old one in one step
+def write_snapshot(path, entries, revision=None):
+    if revision is None:
+        revision = int(time.time())
+    width = max((len(uid) for uid in entries), default=4)
+    if width > 255:
+        raise ValueError(f'UID too long for a snapshot: {width} bytes')
+    records = sorted(
+        (_record_key(uid, width), FLAG_ENROLLED if flag == 'Y' else 0)
+        for uid, flag in entries.items())
+
+    atomic_write(path, HEADER.pack(MAGIC, VERSION, width, 0, len(records), revision)
+                 + b''.join(key + bytes([flags]) for key, flags in records))
+
+
+# Sequence of record keys so bisect can search the mmap directly
+class _KeyView:
+    def __init__(self, mm, count, record_size, key_size):
+        self._mm = mm
+        self._count = count
+        self._record_size = record_size
+        self._key_size = key_size
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i):
+        offset = HEADER.size + i * self._record_size
+        return self._mm[offset:offset + self._key_size]
+
+
+class CredentialSnapshot:
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self._mm) < HEADER.size:
+            raise ValueError(f'{path} is too short to be a credential snapshot')
+        magic, version, width, _, count, self.revision = HEADER.unpack_from(self._mm)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'{path} is not a version {VERSION} credential snapshot')
+        self.width = width
+        self._record_size = width + 2
+        if len(self._mm) != HEADER.size + count * self._record_size:
+            raise ValueError(f'{path} is truncated')
+        self._keys = _KeyView(self._mm, count, self._record_size, width + 1)
+
+    # Same interface as dict.get(), returns 'Y' or 'N' for a known UID
+    def get(self, uid, default=None):
+        if len(uid) > self.width:
+            return default
+        key = _record_key(uid, self.width)
+        i = bisect.bisect_left(self._keys, key)
+        if i == len(self._keys) or self._keys[i] != key:
+            return default
+        flags = self._mm[HEADER.size + i * self._record_size + self.width + 1]
+        return 'Y' if flags & FLAG_ENROLLED else 'N'
+
+    def __len__(self):
+        return len(self._keys)
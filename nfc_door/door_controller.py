@@ -0,0 +1,219 @@
+"""
+asyncio version of the door loop.
+
+Reading the PN532, updating the NeoPixels and reloading the verification sheet
+each run as their own task, the relay is held open by a RelayScheduler timer
+thread and emails go out through the EmailNotifier worker. A tag that is
+presented while the door is held open or an email is going out is handled
+straight away instead of waiting for the previous step to finish.
+"""
+
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from nfc_door.pn532_faults import FaultRecovery
+from nfc_door.relay import RelayScheduler
+from nfc_door.tap_trace import TapTrace, READ_COMPLETE, LOOKUP_COMPLETE, DECISION, RELAY_ON, LED_UPDATE
+from nfc_door.tag_presence import PresenceTracker, TAG_ARRIVED, TAG_DEPARTED
+
+# Define colors
+BLUE = (0, 0, 255)
+GREEN = (0, 255, 0)
+RED = (255, 0, 0)
+
+# Access decisions
+GRANTED = 'granted'
+DENIED = 'denied'
+NOT_ENROLLED = 'not_enrolled'
+
+# Traces still missing a mark after this many seconds are written as they are
+TRACE_TIMEOUT = 10
+
+
+class DoorController:
+    def __init__(self, pn532, credentials, relay_output, pixels, send_email, uart=None,
+                 door_location='', unlock_seconds=5, denied_seconds=2,
+                 read_timeout=0.5, refresh_interval=5, presence_hold_off=1.5,
+                 trace_writer=None, access_log=None, startup=None):
+        self.pn532 = pn532  # PN532_UART or an AutoPollReader wrapping it
+        self.credentials = credentials
+        # relay_output is called with True to open the relay and False to close it
+        self.relay = RelayScheduler(relay_output, on_change=self._relay_changed)
+        self.pixels = pixels
+        self.send_email = send_email
+        self.door_location = door_location
+        self.unlock_seconds = unlock_seconds
+        self.denied_seconds = denied_seconds
+        self.read_timeout = read_timeout
+        self.refresh_interval = refresh_interval  # None when another controller refreshes the shared index
+        self.presence = PresenceTracker(hold_off=presence_hold_off)
+        # uart is the serial.Serial under the reader, used to drop garbled frames before anything heavier
+        self.faults = FaultRecovery(pn532, uart)
+        self.trace_writer = trace_writer  # Optional TraceWriter for per-tap latency traces
+        self.access_log = access_log  # Optional AccessLog, every decision is stored there
+        self.startup = startup  # Optional StartupTimer, told when the door is ready and about its first decision
+
+        # The UART is only ever touched from this single thread
+        self._uart_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='pn532')
+        self._loop = None
+        self._flash = (None, 0.0)
+        self._led_event = None
+        self._open_traces = []
+
+    async def run(self):
+        self._loop = asyncio.get_running_loop()
+        self._led_event = asyncio.Event()
+        tasks = [
+            asyncio.create_task(self._reader_task(), name='reader'),
+            asyncio.create_task(self._led_task(), name='leds'),
+        ]
+        if self.refresh_interval is not None:
+            tasks.append(asyncio.create_task(self._refresh_task(), name='sheet refresh'))
+        print('Waiting for NFC tag...')
+        if self.startup is not None:
+            self.startup.mark('Ready for tags')
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            self.relay.close()
+            if self.trace_writer is not None:
+                self.trace_writer.close()
+            if self.access_log is not None:
+                self.access_log.close()
+            self._uart_executor.shutdown(wait=False)
+
+    # send_email only queues the message for the EmailNotifier worker, so this never blocks the loop
+    def notify(self, subject, body):
+        self.send_email(subject, body)
+
+    # Decide what to do with a tag, everything slow is handed to the other tasks
+    def handle_tag(self, uid, read_complete=None):
+        trace = TapTrace(uid, self.door_location, read_complete)
+        enrolled = self.credentials.lookup(uid)
+        trace.mark(LOOKUP_COMPLETE)
+
+        if enrolled is None:
+            trace.decision = NOT_ENROLLED
+        elif enrolled == 'Y':
+            trace.decision = GRANTED
+        else:
+            trace.decision = DENIED
+        trace.mark(DECISION)
+
+        if trace.decision == GRANTED:
+            if self.relay.is_open:
+                trace.mark(RELAY_ON)  # Already open, this grant only extends the window
+            self.relay.unlock(self.unlock_seconds)
+        else:
+            self.flash(RED, self.denied_seconds)
+        self._led_event.set()
+        if self.trace_writer is not None:
+            self._open_traces.append(trace)
+        if self.access_log is not None:
+            latency_ms = (trace.marks[DECISION] - trace.marks[READ_COMPLETE]) * 1000
+            self.access_log.log(trace.uid, trace.decision, self.door_location, latency_ms)
+
+        if self.startup is not None:
+            self.startup.mark('First authorization')
+        where = f' at {self.door_location}' if self.door_location else ''
+        print(f'Tag with UID {trace.uid.hex()} detected{where}')
+        if trace.decision == GRANTED:
+            print('Access granted')
+        elif trace.decision == DENIED:
+            print('Access denied')
+        else:
+            print('Tag not enrolled')
+        return trace.decision
+
+    # Show a color for a while before going back to the normal state color
+    def flash(self, color, seconds):
+        self._flash = (color, time.monotonic() + seconds)
+        self._led_event.set()
+
+    async def _reader_task(self):
+        read = functools.partial(self.pn532.read_passive_target, timeout=self.read_timeout)
+        while True:
+            try:
+                uid = await self._loop.run_in_executor(self._uart_executor, read)
+            except RuntimeError as e:
+                await self._handle_reader_error(e)
+                continue
+            read_complete = time.monotonic()
+            self.faults.succeeded()
+            # Only new arrivals are authorized, a tag left on the reader gets no second relay pulse
+            for event, tag in self.presence.update(uid, read_complete):
+                if event == TAG_ARRIVED:
+                    self.handle_tag(tag, read_complete)
+                elif event == TAG_DEPARTED:
+                    print('Tag removed')
+
+    async def _handle_reader_error(self, error):
+        # Recovery talks to the PN532 and may back off, so it runs on the UART thread
+        fault = await self._loop.run_in_executor(self._uart_executor, self.faults.handle, error)
+        if fault is None:
+            # Send email notification about the error
+            self.notify('Error in NFC Reader', f'An error occurred in the NFC Reader:\n\n{error}')
+            raise error
+        print(fault.hint)
+        self.flash(RED, 1)
+
+    # Called from the relay timer thread, wake the LED task to show the new state
+    def _relay_changed(self, is_open):
+        at = time.monotonic()
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._led_event.set)
+            if is_open:
+                self._loop.call_soon_threadsafe(self._mark_traces, RELAY_ON, at)
+
+    # Add a mark to the traces waiting for it and write out the ones that are complete
+    def _mark_traces(self, name, at):
+        if not self._open_traces:
+            return
+        still_open = []
+        for trace in self._open_traces:
+            if name != RELAY_ON or trace.decision == GRANTED:
+                trace.mark(name, at)
+            complete = trace.has(LED_UPDATE) and (trace.decision != GRANTED or trace.has(RELAY_ON))
+            if complete or trace.age() > TRACE_TIMEOUT:
+                self.trace_writer.write(trace)
+            else:
+                still_open.append(trace)
+        self._open_traces = still_open
+
+    # Work out which color the strip should show and for how long
+    def _led_state(self):
+        color, until = self._flash
+        remaining = until - time.monotonic()
+        if color is not None and remaining > 0:
+            return color, remaining
+        if self.relay.is_open:
+            return GREEN, None
+        return BLUE, None
+
+    async def _led_task(self):
+        shown = None
+        while True:
+            self._led_event.clear()
+            color, wait = self._led_state()
+            if color != shown:
+                self.pixels.fill(color)
+                self.pixels.show()
+                shown = color
+            self._mark_traces(LED_UPDATE, time.monotonic())
+            try:
+                await asyncio.wait_for(self._led_event.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+    # Pick up changes to the local verification sheet without touching the tap path
+    async def _refresh_task(self):
+        while True:
+            try:
+                await self._loop.run_in_executor(None, self.credentials.refresh)
+            except Exception as e:
+                print(f'Error reloading verification sheet: {e}')
+            await asyncio.sleep(self.refresh_interval)
@@ -0,0 +1,77 @@
+"""
+Background sync and access log upload for the door scripts.
+
+Every door script keeps its credential index in step with Google Sheets, or
+with a Credential_Hub.py when [hub] HUB_URL is set, and uploads its access log
+to a tab when LOG_RANGE is set, in its own spreadsheet if LOG_SHEET_ID is set.
+start_sync() reads those settings from the loaded settings.toml and starts
+both, so the scripts only have to load their credentials first.
+"""
+
+from nfc_door.access_rules import merge_rule_columns
+from nfc_door.access_upload import AccessUploader, last_row
+from nfc_door.credential_hub import HubSync
+from nfc_door.sheet_sync import SheetSync
+from nfc_door.sheet_versions import SheetVersions
+from nfc_door.sheets_client import SheetsClient, sheet_tab
+
+
+# Print what a new version of the access sheet changed
+def report_change(version, diff):
+    print(f"Access sheet version {version['seq']}: {len(diff['granted'])} granted, {len(diff['revoked'])} revoked")
+
+
+# Start the sheet (or hub) sync and the access log upload, returns (sheet_sync, access_upload or None)
+# door names this door to the hub and in the uploaded log, startup gets a mark at the first download
+def start_sync(config, credentials, door='', startup=None):
+    google = config['google_api']
+    hub = config.get('hub', {})
+    access_log = config.get('door', {}).get('ACCESS_LOG', 'access_log.bin')
+    log_range = google.get('LOG_RANGE', '')  # Tab the access log is uploaded to, empty to turn off
+    log_sheet_id = google.get('LOG_SHEET_ID', '')  # Spreadsheet of that tab, empty for the access sheet's
+    cell_range = f'{sheet_tab(google)}!A:B'
+    rules_range = f'{sheet_tab(google)}!F:G'  # Optional schedule and expiry date, see nfc_door/access_rules.py
+
+    # One Google Sheets client for the sheet sync and the access log upload, they share its pooled connections.
+    # It logs in on its first request from those background threads, so the door never waits for Google
+    token_cache = google.get('TOKEN_CACHE', '.sheets_token.json')
+    sheets = SheetsClient(google['SERVICE_ACCOUNT_FILE'], google['SHEET_ID'], token_cache=token_cache)
+
+    def fetch_rows():
+        flags, rules = sheets.batch_get([cell_range, rules_range])
+        rows = merge_rule_columns(flags, rules)
+        if startup is not None:
+            startup.mark('First Google Sheets download')
+        return rows
+
+    if hub.get('HUB_URL'):
+        sheet_sync = HubSync(hub['HUB_URL'], credentials, interval=hub.get('HUB_INTERVAL', 10), door=door,
+                             token=hub.get('HUB_TOKEN', ''))
+    else:
+        versions_dir = google.get('VERSIONS_DIR', 'sheet_versions')  # Last downloads of the sheet, empty to turn off
+        versions = SheetVersions(versions_dir, google.get('KEEP_VERSIONS', 10)) if versions_dir else None
+        sheet_sync = SheetSync(fetch_rows, credentials, interval=google.get('SYNC_INTERVAL', 300),
+                               fetch_marker=sheets.file_version, versions=versions, on_change=report_change)
+    sheet_sync.start()
+
+    if not log_range:
+        return sheet_sync, None
+    if log_sheet_id and log_sheet_id != google['SHEET_ID']:
+        sheets = SheetsClient(google['SERVICE_ACCOUNT_FILE'], log_sheet_id, token_cache=token_cache)
+    elif not hub.get('HUB_URL'):
+        # Every upload moves the Drive version of the spreadsheet, so the sync downloads the sheet every time
+        print('LOG_RANGE is in the access sheet, set LOG_SHEET_ID so the sync can skip unchanged sheets')
+
+    # Returns the last row written, so a failed upload only has to check the rows below it
+    def append_log_rows(rows):
+        result = sheets.append(f'{log_range}!A:F', rows, value_input='RAW')
+        return last_row(result.get('updates', {}).get('updatedRange', ''))
+
+    def fetch_log_ids(first_row):
+        return [row[0] for row in sheets.get_values(f'{log_range}!F{first_row}:F') if row]
+
+    # The access log goes to the log tab in large batches from a background thread
+    access_upload = AccessUploader(append_log_rows, fetch_log_ids, access_log, source=door or None,
+                                   interval=google.get('UPLOAD_INTERVAL', 60))
+    access_upload.start()
+    return sheet_sync, access_upload
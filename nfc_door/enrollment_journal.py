@@ -0,0 +1,125 @@
+"""
+Write-ahead journal for the enrollment tools.
+
+Every enrollment and every name/child edit is appended to a local JSON lines
+file and fsynced before the tool moves on, so nothing is lost when the network
+or the Pi goes down. The tools update their local copy of the sheet straight
+away and replay the journal to Google Sheets whenever it is reachable.
+
+Replaying is idempotent: tags already in the sheet are not appended again and
+edits write absolute values, so replaying an entry twice does no harm. Entries
+are replayed in journal order, enrollments first so an edit always finds its
+row. Once a replay went through an {"ack": seq} line is appended, and when
+every entry is acknowledged the file is compacted down to that one line.
+
+apply_to_door_cache() adds the pending enrollments to the local verification
+sheet of a door on the same Pi, which reloads it on its next refresh. A tag
+enrolled offline then opens that door straight away instead of after its
+round trip through Google Sheets.
+"""
+
+import json
+import os
+import time
+
+from nfc_door.atomic_file import atomic_write
+from nfc_door.credential_index import write_verification_sheet
+
+ENROLL = 'enroll'
+EDIT = 'edit'
+
+
+class EnrollmentJournal:
+    def __init__(self, path):
+        self.path = path
+        self.entries = []
+        self.acked = 0
+        self._load()
+        self._file = open(path, 'a')
+
+    def _load(self):
+        try:
+            with open(self.path, 'rb+') as f:
+                data = f.read()
+                # Cut off a line torn by a power cut, the next record would be glued onto it
+                end = data.rfind(b'\n') + 1
+                if end < len(data):
+                    f.truncate(end)
+        except FileNotFoundError:
+            return
+        for line in data[:end].decode().splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if 'ack' in record:
+                self.acked = max(self.acked, record['ack'])
+            else:
+                self.entries.append(record)
+        self.entries = [entry for entry in self.entries if entry['seq'] > self.acked]
+
+    def _write(self, record):
+        self._file.write(json.dumps(record, separators=(',', ':')) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    # Append a change and make it durable, values is [last name, first name, child] for an edit
+    def record(self, op, uid, values=None):
+        seq = self.entries[-1]['seq'] + 1 if self.entries else self.acked + 1
+        entry = {'seq': seq, 'time': round(time.time(), 3), 'op': op, 'uid': uid}
+        if values is not None:
+            entry['values'] = list(values)
+        self._write(entry)
+        self.entries.append(entry)
+        return entry
+
+    # Entries not replayed to the sheet yet, oldest first
+    def pending(self):
+        return list(self.entries)
+
+    # Mark every entry up to seq as replayed
+    def acknowledge(self, seq):
+        self.acked = max(self.acked, seq)
+        self.entries = [entry for entry in self.entries if entry['seq'] > self.acked]
+        if self.entries:
+            self._write({'ack': self.acked})
+            return
+        # Nothing left, start the file over with just the last sequence number
+        self._file.close()
+        atomic_write(self.path, json.dumps({'ack': self.acked}) + '\n')
+        self._file = open(self.path, 'a')
+
+    def close(self):
+        self._file.close()
+
+
+# Add the pending enrollments to a door's local verification sheet as enrolled, returns how many were new there
+def apply_to_door_cache(journal, path):
+    uids = [entry['uid'] for entry in journal.pending() if entry['op'] == ENROLL]
+    if not uids:
+        return 0
+    try:
+        with open(path) as f:
+            rows = [line.strip().split(',') for line in f if line.strip()]
+    except FileNotFoundError:
+        rows = []
+    known = {row[0].strip().lower() for row in rows}
+    new = [uid for uid in dict.fromkeys(uids) if uid.lower() not in known]
+    if new:
+        write_verification_sheet(path, rows + [[uid, 'Y'] for uid in new])
+    return len(new)
+
+
+# Replay the pending entries to the sheet through a SheetRowIndex
+# Returns the UIDs whose edits were dropped because they are no longer in the sheet
+def replay_to_sheet(journal, rows):
+    entries = journal.pending()
+    if not entries:
+        return []
+    rows.append_enrolled([entry['uid'] for entry in entries if entry['op'] == ENROLL])
+    for entry in entries:
+        if entry['op'] == EDIT:
+            rows.stage(entry['uid'], *entry['values'])
+    missing = rows.commit()
+    journal.acknowledge(entries[-1]['seq'])
+    return missing
@@ -0,0 +1,171 @@
+"""
+Hardware backends for the door: the tag reader, the relay and the LED strip.
+
+The door logic only relies on these small interfaces:
+
+    reader   read_passive_target(timeout) -> UID bytes or None, reset(),
+             SAM_configuration()
+    relay    called with True to energise the relay and False to release it
+    pixels   fill(color) and show(), like neopixel.NeoPixel
+
+The real backends import RPi.GPIO, board, neopixel, serial and adafruit_pn532
+only when they are opened. The simulated ones need nothing but the standard
+library and can be given a schedule of tag arrivals and reader errors, so the
+whole door loop runs on a plain Linux box.
+"""
+
+import heapq
+import time
+
+from nfc_door.pn532_autopoll import AutoPollReader
+from nfc_door.uart_capture import RecordingSerial
+
+
+# Open the PN532 on a serial port, returns (reader, serial port)
+# With capture_path set all UART traffic is recorded there, see uart_capture.py
+def open_pn532(port='/dev/ttyUSB0', baudrate=115200, timeout=0.1, autopoll=True, capture_path=None):
+    import serial
+
+    uart = serial.Serial(port, baudrate=baudrate, timeout=timeout)
+    if capture_path:
+        uart = RecordingSerial(uart, capture_path)
+    return open_pn532_on(uart, autopoll)
+
+
+# Put the PN532 driver on an already open port, e.g. a uart_capture.ReplaySerial
+def open_pn532_on(uart, autopoll=True):
+    from adafruit_pn532.uart import PN532_UART
+
+    pn532 = PN532_UART(uart, debug=False)
+    if autopoll:
+        return AutoPollReader(pn532, uart), uart
+    return pn532, uart
+
+
+class GPIORelay:
+    def __init__(self, pin=24):
+        import RPi.GPIO as GPIO
+
+        self.pin = pin
+        self._gpio = GPIO
+        GPIO.setwarnings(False)
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setup(pin, GPIO.OUT)
+
+    def __call__(self, on):
+        self._gpio.output(self.pin, self._gpio.HIGH if on else self._gpio.LOW)
+
+
+# Open a NeoPixel strip, pin is the name of the board pin, e.g. 'D18'
+def open_neopixels(pin='D18', count=7, brightness=0.15):
+    import board
+    import neopixel
+
+    return neopixel.NeoPixel(getattr(board, pin), count, brightness=brightness, auto_write=False)
+
+
+# A run of LEDs on a shared strip, so several doors can each light up their own part
+class PixelSegment:
+    def __init__(self, strip, first, count):
+        self.strip = strip
+        self.first = first
+        self.count = count
+
+    def fill(self, color):
+        for i in range(self.first, self.first + self.count):
+            self.strip[i] = color
+
+    def show(self):
+        self.strip.show()
+
+
+# Convert a hex string or bytes into UID bytes
+def _uid_bytes(uid):
+    return bytes.fromhex(uid) if isinstance(uid, str) else bytes(uid)
+
+
+class SimulatedReader:
+    def __init__(self, read_latency=0.005, clock=time.monotonic, sleep=time.sleep):
+        self.read_latency = read_latency  # Time a successful read takes, like the UART round trip
+        self.clock = clock
+        self.sleep = sleep
+        self.reads = 0
+        self.resets = 0
+        self._start = clock()
+        self._tags = []  # heap of (arrival, departure, uid)
+        self._errors = []  # heap of (time, message)
+
+    # Put a tag on the reader at seconds after start for hold seconds
+    def add_tag(self, uid, at, hold=0.3):
+        heapq.heappush(self._tags, (at, at + hold, _uid_bytes(uid)))
+
+    # Make a read at or after the given time raise a RuntimeError with this message
+    def add_error(self, message, at):
+        heapq.heappush(self._errors, (at, message))
+
+    # Seconds since the reader was created
+    def elapsed(self):
+        return self.clock() - self._start
+
+    # True once every scheduled tag has left the reader
+    def finished(self):
+        return not self._tags and not self._errors
+
+    def read_passive_target(self, timeout=1):
+        self.reads += 1
+        deadline = self.elapsed() + timeout
+        while True:
+            now = self.elapsed()
+            while self._tags and self._tags[0][1] <= now:
+                heapq.heappop(self._tags)
+            if self._errors and self._errors[0][0] <= now:
+                raise RuntimeError(heapq.heappop(self._errors)[1])
+            if self._tags and self._tags[0][0] <= now:
+                if self.read_latency:
+                    self.sleep(self.read_latency)
+                return bytearray(self._tags[0][2])
+
+            upcoming = [deadline]
+            if self._tags:
+                upcoming.append(self._tags[0][0])
+            if self._errors:
+                upcoming.append(self._errors[0][0])
+            wake = min(upcoming)
+            if wake >= deadline and now >= deadline:
+                return None
+            self.sleep(max(0.0, min(wake, deadline) - now))
+
+    def reset(self):
+        self.resets += 1
+
+    def SAM_configuration(self):
+        pass
+
+
+class SimulatedRelay:
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.is_on = False
+        self.transitions = []  # (time, on)
+
+    def __call__(self, on):
+        self.is_on = on
+        self.transitions.append((self.clock(), on))
+
+
+class SimulatedPixels:
+    def __init__(self, clock=time.monotonic, verbose=False):
+        self.clock = clock
+        self.verbose = verbose
+        self.color = None
+        self.shown = []  # (time, color)
+        self._pending = None
+
+    def fill(self, color):
+        self._pending = color
+
+    def show(self):
+        self.color = self._pending
+        self.shown.append((self.clock(), self.color))
+        if self.verbose:
+            print(f'LEDs: {self.color}')
@@ -0,0 +1,108 @@
+"""
+Background email notifications.
+
+send_email() used to open a new SMTP_SSL connection, log in, send and quit on
+the caller's thread, so a slow mail server held up the door. EmailNotifier puts
+messages on a bounded queue that a worker thread sends over one logged in
+connection. The connection is kept alive with NOOPs and reopened when it drops.
+When the queue is full new messages are counted as dropped instead of waiting.
+"""
+
+import queue
+import smtplib
+import threading
+
+_STOP = object()
+
+
+class EmailNotifier:
+    def __init__(self, sender, password, receiver, host='smtp.gmail.com', port=465,
+                 queue_size=20, keepalive_seconds=60, timeout=10, smtp_factory=smtplib.SMTP_SSL):
+        self.sender = sender
+        self.password = password
+        self.receiver = receiver
+        self.host = host
+        self.port = port
+        self.keepalive_seconds = keepalive_seconds
+        self.timeout = timeout
+        self.smtp_factory = smtp_factory
+
+        # Counters for monitoring
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._server = None
+        self._thread = threading.Thread(target=self._run, name='email', daemon=True)
+        self._thread.start()
+
+    # Queue an email, never blocks the caller
+    def send(self, subject, body):
+        try:
+            self._queue.put_nowait((subject, body))
+        except queue.Full:
+            self.dropped += 1
+
+    # Send whatever is still queued and stop the worker
+    def close(self, timeout=10):
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+
+    def _connect(self):
+        server = self.smtp_factory(self.host, self.port, timeout=self.timeout)
+        server.login(self.sender, self.password)
+        self._server = server
+
+    def _disconnect(self):
+        if self._server is None:
+            return
+        try:
+            self._server.quit()
+        except Exception:
+            pass
+        self._server = None
+
+    def _deliver(self, subject, body):
+        message = f'Subject: {subject}\n\n{body}'
+        # Try the open connection first and log in again once if it was dropped
+        for attempt in range(2):
+            try:
+                if self._server is None:
+                    self._connect()
+                self._server.sendmail(self.sender, self.receiver, message)
+                return
+            except (smtplib.SMTPServerDisconnected, OSError):
+                self._server = None
+                if attempt:
+                    raise
+
+    # Check the idle connection is still alive, drop it if the server hung up
+    def _keepalive(self):
+        if self._server is None:
+            return
+        try:
+            self._server.noop()
+        except Exception:
+            self._server = None
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=self.keepalive_seconds)
+            except queue.Empty:
+                self._keepalive()
+                continue
+            if item is _STOP:
+                break
+            try:
+                self._deliver(*item)
+                self.sent += 1
+            except Exception as e:
+                self.failed += 1
+                self._disconnect()
+                print(f'Failed to send email: {e}')
+        self._disconnect()
@@ -0,0 +1,102 @@
+"""
+PN532 reader mode built on InAutoPoll.
+
+read_passive_target() sends InListPassiveTarget over the UART every call, and
+the scripts slept between calls on top of that. Here the PN532 is armed once
+with InAutoPoll and searches for cards on its own. The serial port is then
+watched with select(), so the host uses no CPU and sends nothing while the
+field is empty, and a card is reported as soon as the chip has seen it.
+
+AutoPollReader has the same read_passive_target(), reset() and
+SAM_configuration() methods as PN532_UART, so the door loops can use either.
+It needs adafruit_pn532 2.3 or newer for send_command().
+"""
+
+import select
+import time
+
+_COMMAND_INAUTOPOLL = 0x60
+_PN532_TO_HOST = 0xD5
+_ACK = b'\x00\x00\xff\x00\xff\x00'
+
+# InAutoPoll target types
+TYPE_GENERIC_106_A = 0x00  # Generic passive 106 kbps: Mifare, ISO14443-4A and DEP targets
+TYPE_MIFARE = 0x10
+
+POLL_FOREVER = 0xFF
+
+
+class AutoPollReader:
+    def __init__(self, pn532, uart, period=1, target_types=(TYPE_GENERIC_106_A,)):
+        self.pn532 = pn532
+        self.uart = uart
+        self.period = period  # Time between polls in units of 150 ms, 1 to 15
+        self.target_types = list(target_types)
+        self._armed = False
+
+    # Start the PN532 polling on its own, it answers once it has found a card
+    def arm(self):
+        params = [POLL_FOREVER, self.period] + self.target_types
+        if not self.pn532.send_command(_COMMAND_INAUTOPOLL, params=params, timeout=1):
+            raise RuntimeError('Did not receive expected ACK from PN532!')
+        self._armed = True
+
+    # Stop a running InAutoPoll, sending an ACK frame aborts the current command
+    def cancel(self):
+        if self._armed:
+            self.uart.write(_ACK)
+            time.sleep(0.01)
+            self.uart.reset_input_buffer()
+            self._armed = False
+
+    # Wait up to timeout seconds for a card and return its UID, or None
+    def read_passive_target(self, timeout=1):
+        if not self._armed:
+            self.arm()
+        if not self.uart.in_waiting:
+            readable, _, _ = select.select([self.uart.fileno()], [], [], timeout)
+            if not readable:
+                return None
+        # The command is finished once the PN532 answers, it has to be armed again
+        self._armed = False
+        return self._parse_targets(self._read_response(timeout=0.1))
+
+    def reset(self):
+        self._armed = False
+        self.pn532.reset()
+
+    def SAM_configuration(self):
+        self._armed = False
+        self.pn532.SAM_configuration()
+
+    # Read one information frame and return the data after the TFI and response code
+    def _read_response(self, timeout):
+        deadline = time.monotonic() + timeout
+        frame = bytearray()
+        while True:
+            frame += self.uart.read(max(1, self.uart.in_waiting))
+            start = frame.find(b'\x00\xff')
+            if start >= 0 and len(frame) >= start + 4:
+                length = frame[start + 2]
+                if (length + frame[start + 3]) & 0xFF:
+                    raise RuntimeError('Response length checksum did not match length!')
+                # Data, data checksum and the postamble
+                end = start + 4 + length + 2
+                if len(frame) >= end:
+                    data = frame[start + 4:start + 4 + length]
+                    if (sum(data) + frame[end - 2]) & 0xFF:
+                        raise RuntimeError('Response checksum did not match expected value')
+                    if data[0] != _PN532_TO_HOST or data[1] != _COMMAND_INAUTOPOLL + 1:
+                        raise RuntimeError('Received unexpected command response!')
+                    return bytes(data[2:])
+            if time.monotonic() > deadline:
+                raise RuntimeError('Response frame from PN532 was incomplete')
+
+    # Pull the UID of the first ISO14443A target out of an InAutoPoll response
+    def _parse_targets(self, response):
+        if not response or response[0] == 0:
+            return None
+        target_data = response[3:3 + response[2]]
+        # Tg, SENS_RES (2 bytes), SEL_RES, NFCID length, NFCID
+        uid_length = target_data[4]
+        return bytearray(target_data[5:5 + uid_length])
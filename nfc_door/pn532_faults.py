@@ -0,0 +1,125 @@
+"""
+Typed PN532 errors and stepwise recovery.
+
+adafruit_pn532 raises a plain RuntimeError for every UART problem, and the
+door scripts told them apart by matching message text, then did a full reset
+with a one second sleep (twice in V7) for each one. classify() turns those
+messages into ReaderFault subclasses, and FaultRecovery tries the cheapest fix
+first: drop whatever is in the serial buffer, then send SAM_configuration
+again, and only then reset the chip. Repeated faults back off exponentially,
+and every fault type is counted.
+"""
+
+import time
+from collections import Counter
+
+
+class ReaderFault(RuntimeError):
+    hint = 'NFC reader error. Please try again.'
+
+
+class AckError(ReaderFault):
+    hint = 'Did not receive expected ACK from NFC tag. Please try again.'
+
+
+class ChecksumError(ReaderFault):
+    hint = 'Move the tag closer to the NFC reader and try again.'
+
+
+class LengthChecksumError(ReaderFault):
+    hint = 'Checksum error. Please present the tag again.'
+
+
+class FrameError(ReaderFault):
+    hint = 'Garbled response from the NFC reader. Resyncing...'
+
+
+# Lower case message fragments from adafruit_pn532 and AutoPollReader
+_FAULT_MESSAGES = (
+    ('did not receive expected ack', AckError),
+    ('response checksum did not match', ChecksumError),
+    ('response length checksum did not match', LengthChecksumError),
+    ('preamble does not contain', FrameError),
+    ('response contains no data', FrameError),
+    ('unexpected command response', FrameError),
+    ('response frame from pn532 was incomplete', FrameError),
+)
+
+
+# Turn a RuntimeError from the reader into a ReaderFault, or None if it is something else
+def classify(error):
+    if isinstance(error, ReaderFault):
+        return error
+    message = str(error).lower()
+    for fragment, fault_class in _FAULT_MESSAGES:
+        if fragment in message:
+            fault = fault_class(str(error))
+            fault.__cause__ = error
+            return fault
+    return None
+
+
+class FaultRecovery:
+    def __init__(self, reader, uart=None, base_delay=0.05, max_delay=5, reset_settle=1,
+                 quiet_period=30):
+        self.reader = reader  # PN532_UART or AutoPollReader
+        self.uart = uart
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.reset_settle = reset_settle  # Seconds to wait after a full reset
+        self.quiet_period = quiet_period  # A fault after this long without one starts a new streak
+        self.counts = Counter()  # Faults seen, by class name
+        self.recoveries = Counter()  # Recovery steps taken: resync, configure, reset
+        self._streak = 0
+        self._last_fault = 0.0
+
+    # Call after a read that went through, so the next fault starts with the cheap fix again
+    def succeeded(self):
+        self._streak = 0
+
+    # Recover from a reader error, returns the ReaderFault or None if the error is not a reader fault
+    def handle(self, error):
+        fault = classify(error)
+        if fault is None:
+            return None
+        now = time.monotonic()
+        if now - self._last_fault > self.quiet_period:
+            self._streak = 0
+        self._last_fault = now
+        self._streak += 1
+        self.counts[type(fault).__name__] += 1
+
+        if self._streak > 1:
+            time.sleep(min(self.max_delay, self.base_delay * 2 ** (self._streak - 2)))
+        try:
+            if self._streak == 1:
+                self._resync()
+            elif self._streak == 2:
+                self._configure()
+            else:
+                self._reset()
+        except Exception as e:
+            print(f'Error during PN532 recovery: {e}')
+            try:
+                self._reset()
+            except Exception as e:
+                print(f'Error during PN532 reset: {e}')
+        return fault
+
+    # Throw away a half received frame
+    def _resync(self):
+        self.recoveries['resync'] += 1
+        if self.uart is not None:
+            self.uart.reset_input_buffer()
+
+    def _configure(self):
+        self.recoveries['configure'] += 1
+        if self.uart is not None:
+            self.uart.reset_input_buffer()
+        self.reader.SAM_configuration()
+
+    def _reset(self):
+        self.recoveries['reset'] += 1
+        self.reader.reset()
+        time.sleep(self.reset_settle)  # Wait for the reset to complete
+        self.reader.SAM_configuration()
@@ -0,0 +1,74 @@
+"""
+Relay scheduler that keeps the door open on a timer thread.
+
+The door scripts used to hold the relay with time.sleep(5), which stopped the
+reader for the whole unlock window. Here the caller just asks for the door to
+be unlocked for N seconds and carries on. A grant that arrives while the door
+is already open moves the closing time back instead of queuing another pulse.
+"""
+
+import threading
+import time
+
+
+class RelayScheduler:
+    def __init__(self, output, on_change=None):
+        self.output = output  # Called with True to energise the relay and False to release it
+        self.on_change = on_change  # Optional callback with the new open/closed state
+        self._cond = threading.Condition()
+        self._open_until = 0.0
+        self._is_open = False
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name='relay', daemon=True)
+        self._thread.start()
+
+    # Unlock the door for the given number of seconds from now
+    def unlock(self, seconds):
+        with self._cond:
+            self._open_until = max(self._open_until, time.monotonic() + seconds)
+            self._cond.notify()
+
+    # Close the door right away
+    def lock(self):
+        with self._cond:
+            self._open_until = 0.0
+            self._cond.notify()
+
+    @property
+    def is_open(self):
+        return self._is_open
+
+    # Seconds left before the relay releases, 0 when it is closed
+    def remaining(self):
+        return max(0.0, self._open_until - time.monotonic())
+
+    # Stop the timer thread and leave the relay released
+    def close(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self._thread.join()
+
+    def _set(self, is_open):
+        self.output(is_open)
+        self._is_open = is_open
+        if self.on_change is not None:
+            try:
+                self.on_change(is_open)
+            except Exception as e:
+                print(f'Error in relay state callback: {e}')
+
+    def _run(self):
+        with self._cond:
+            while not self._stopped:
+                remaining = self._open_until - time.monotonic()
+                if remaining > 0:
+                    if not self._is_open:
+                        self._set(True)
+                    self._cond.wait(remaining)
+                else:
+                    if self._is_open:
+                        self._set(False)
+                    self._cond.wait()
+            if self._is_open:
+                self._set(False)
@@ -0,0 +1,117 @@
+"""
+Local UID to row index of the Google Sheet, for the enrollment tools.
+
+The index keeps a copy of columns A:E and the row number of every UID. New
+tags are appended at the bottom of the sheet, so a refresh only downloads the
+rows after the last one it knows about, and appending new tags skips the
+ones that are already there. Edits to the name and child columns
+are staged and sent together with one batch_update. Just before that the UID
+cell of every staged row is read back in one batch_get. If a
+row was moved (sorted, deleted) the whole range is loaded again and the edits
+go to the rows the UIDs are in now.
+"""
+
+COLUMNS = 'A:E'
+
+
+class SheetRowIndex:
+    def __init__(self, sheets, tab):
+        self.sheets = sheets  # SheetsClient
+        self.tab = tab
+        self.rows = []  # Row values, rows[0] is sheet row 1
+        self._row_numbers = {}  # UID -> sheet row number
+        self._staged = {}  # UID -> [last name, first name, child]
+
+    def _add_rows(self, rows):
+        for row in rows:
+            self.rows.append(row)
+            if row and row[0] not in self._row_numbers:
+                self._row_numbers[row[0]] = len(self.rows)
+
+    # Download the whole range again
+    def reload(self):
+        rows = self.sheets.get_values(f'{self.tab}!{COLUMNS}')
+        self.rows = []
+        self._row_numbers = {}
+        self._add_rows(rows)
+
+    # Download only the rows below the last known one, returns how many were new
+    def refresh(self):
+        first = len(self.rows) + 1
+        rows = self.sheets.get_values(f'{self.tab}!A{first}:E')
+        self._add_rows(rows)
+        return len(rows)
+
+    # Append enrolled rows for the UIDs that are not in the sheet yet, returns the ones appended
+    def append_enrolled(self, uids):
+        self.refresh()
+        new = [uid for uid in dict.fromkeys(uids) if uid not in self._row_numbers]
+        if new:
+            self.sheets.append(f'{self.tab}!A:B', [[uid, 'Y'] for uid in new])
+            self.refresh()
+        return new
+
+    # True if the UID is in the local copy, never goes to the network
+    def __contains__(self, uid):
+        return uid in self._row_numbers
+
+    # Sheet row number of a UID, refreshes once if it is not known yet
+    def row_number(self, uid):
+        if uid not in self._row_numbers:
+            self.refresh()
+        return self._row_numbers.get(uid)
+
+    # Row values of a UID with staged edits applied, or None
+    def row(self, uid):
+        number = self.row_number(uid)
+        if number is None:
+            return None
+        row = list(self.rows[number - 1])
+        if uid in self._staged:
+            row = (row + [''] * 5)[:2] + self._staged[uid]
+        return row
+
+    def stage(self, uid, last_name, first_name, child):
+        self._staged[uid] = [last_name, first_name, child]
+
+    @property
+    def staged(self):
+        return len(self._staged)
+
+    # True if every staged row that has a row number still has its UID in column A
+    def _rows_unchanged(self):
+        uids = [uid for uid in self._staged if uid in self._row_numbers]
+        if not uids:
+            return True
+        ranges = [f'{self.tab}!A{self._row_numbers[uid]}' for uid in uids]
+        for uid, values in zip(uids, self.sheets.batch_get(ranges)):
+            if not values or values[0][0] != uid:
+                return False
+        return True
+
+    # Write every staged edit with one batchUpdate, returns the UIDs that are no longer in the sheet
+    def commit(self):
+        if not self._staged:
+            return []
+        if any(uid not in self._row_numbers for uid in self._staged):
+            self.refresh()  # Someone may have added it below the known rows since
+        if not self._rows_unchanged():
+            self.reload()
+
+        data = []
+        missing = []
+        for uid, values in self._staged.items():
+            number = self._row_numbers.get(uid)
+            if number is None:
+                missing.append(uid)
+                continue
+            data.append({'range': f'{self.tab}!C{number}:E{number}', 'values': [values]})
+        if data:
+            self.sheets.batch_update(data)
+
+        for uid, values in self._staged.items():
+            number = self._row_numbers.get(uid)
+            if number is not None:
+                self.rows[number - 1] = (list(self.rows[number - 1]) + [''] * 5)[:2] + values
+        self._staged = {}
+        return missing
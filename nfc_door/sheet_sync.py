@@ -0,0 +1,110 @@
+"""
+Periodic Google Sheets sync for a running door.
+
+The door scripts only downloaded the access sheet at startup (or not at all),
+so a revoked tag kept working until the process restarted. SheetSync downloads
+the sheet on a background thread every few minutes, builds the new UID dict
+there and swaps it into the CredentialIndex in one assignment. The local
+verification sheet and snapshot are rewritten through a temp file and a rename
+so a crash never leaves a half written file behind.
+
+With fetch_marker each sync first asks for a marker that changes with every
+edit (Drive's version number). While it stays the same nothing is downloaded.
+The marker is read before the rows, so an edit in between only costs one more
+download. The marker is the version of the whole spreadsheet, so an access log
+uploaded to a tab of the same spreadsheet moves it every upload and the sheet is
+downloaded every time; give the log its own spreadsheet (LOG_SHEET_ID). Rows
+whose digest matches the last sync are not written again. With versions the
+downloads are kept in a SheetVersions store, and on_change gets the (version,
+diff) of every new version.
+"""
+
+import threading
+import time
+
+from nfc_door.sheet_versions import rows_digest
+
+
+class SheetSync:
+    def __init__(self, fetch_rows, credentials, interval=300, fetch_marker=None, versions=None, on_change=None):
+        self.fetch_rows = fetch_rows  # Returns the sheet rows, e.g. SheetsClient.get_values()
+        self.credentials = credentials
+        self.interval = interval
+        self.fetch_marker = fetch_marker  # Returns a marker that changes with every edit, e.g. SheetsClient.file_version()
+        self.versions = versions  # SheetVersions the downloads are kept in
+        self.on_change = on_change  # Called with (version, diff) for every new version
+        self.last_sync = None  # time.time() of the last successful sync
+        self.downloads = 0
+        self.skipped = 0  # Syncs the marker showed nothing had changed
+        self._marker = None
+        self._digest = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    # Ask for the marker, None if there is none and the sheet has to be downloaded
+    def _check_marker(self):
+        if self.fetch_marker is None:
+            return None
+        try:
+            return self.fetch_marker()
+        except Exception as e:
+            if getattr(e, 'status', None) == 403:
+                # Most likely the Drive API is not enabled, don't ask again every sync
+                print(f'Cannot check Google Sheets for changes, downloading it every time: {e}')
+                self.fetch_marker = None
+            else:
+                print(f'Error checking Google Sheets for changes: {e}')
+            return None
+
+    # Download the sheet once and swap it in, returns True on success
+    def sync_once(self):
+        marker = self._check_marker()
+        if marker is not None and marker == self._marker:
+            self.skipped += 1
+            self.last_sync = time.time()
+            return True
+
+        try:
+            rows = self.fetch_rows()
+        except Exception as e:
+            print(f'Error downloading Google Sheets: {e}')
+            return False
+        self.downloads += 1
+        if not rows:
+            # An empty answer is more likely a bad range than an empty access list, keep the old one
+            print('Google Sheets returned no rows, keeping the current verification sheet')
+            return False
+
+        digest = rows_digest(rows)
+        if digest != self._digest:
+            self.credentials.update(rows)
+            self._digest = digest
+        self._store(rows, marker)
+        self._marker = marker
+        self.last_sync = time.time()
+        return True
+
+    def _store(self, rows, marker):
+        if self.versions is None:
+            return
+        try:
+            added = self.versions.add(rows, marker)
+        except OSError as e:
+            print(f'Error storing sheet version: {e}')
+            return
+        if added is not None and self.on_change is not None:
+            self.on_change(*added)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='sheet sync', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.sync_once()
+            self._stop.wait(self.interval)
@@ -0,0 +1,115 @@
+"""
+Versioned local copies of the access sheet.
+
+SheetVersions keeps the last keep downloads of the sheet that differ from one
+another. Each is a numbered JSON file in a directory, holding the rows, their
+SHA-256 digest and the Drive version marker the download was made at. add()
+stores rows only when their digest differs from the newest version. It then
+returns what changed against that version: the UIDs granted (now 'Y', before
+not), revoked (before 'Y', now not), and added to or removed from the sheet.
+The door, the log or the notifier can act on that diff instead of on the
+whole list.
+
+    python3 -m nfc_door.sheet_versions sheet_versions     # list the versions and the newest diff
+"""
+
+import hashlib
+import json
+import os
+import sys
+import time
+
+from nfc_door.atomic_file import atomic_write
+from nfc_door.credential_hub import rows_to_dict
+
+
+# SHA-256 of sheet rows, equal rows give equal digests
+def rows_digest(rows):
+    return hashlib.sha256(json.dumps(rows, separators=(',', ':')).encode()).hexdigest()
+
+
+# What changed from one list of sheet rows to the next, UIDs as the sheet has them in lower case
+def diff_rows(old_rows, new_rows):
+    old = rows_to_dict(old_rows)
+    new = rows_to_dict(new_rows)
+    return {
+        'granted': sorted(uid for uid, flag in new.items() if flag == 'Y' and old.get(uid) != 'Y'),
+        'revoked': sorted(uid for uid, flag in old.items() if flag == 'Y' and new.get(uid) != 'Y'),
+        'added': sorted(set(new) - set(old)),
+        'removed': sorted(set(old) - set(new)),
+    }
+
+
+class SheetVersions:
+    def __init__(self, directory, keep=10):
+        self.directory = directory
+        self.keep = max(1, keep)
+        os.makedirs(directory, exist_ok=True)
+        self.seqs = sorted(int(name[:-5]) for name in os.listdir(directory)
+                           if name.endswith('.json') and name[:-5].isdigit())
+        self._latest = None
+        if self.seqs:
+            try:
+                self._latest = self.get(self.seqs[-1])
+            except (OSError, ValueError) as e:
+                print(f'Ignoring unreadable sheet version: {e}')
+
+    def _path(self, seq):
+        return os.path.join(self.directory, f'{seq:08d}.json')
+
+    def _write(self, version):
+        atomic_write(self._path(version['seq']), json.dumps(version, separators=(',', ':')))
+
+    # A stored version: {'seq', 'time', 'marker', 'digest', 'rows'}
+    def get(self, seq):
+        with open(self._path(seq)) as f:
+            return json.load(f)
+
+    # The newest version, or None before the first download
+    def latest(self):
+        return self._latest
+
+    # Store rows as a new version if they changed, returns (version, diff) or None if they did not
+    def add(self, rows, marker=None):
+        digest = rows_digest(rows)
+        latest = self._latest
+        if latest is not None and latest['digest'] == digest:
+            # Edits elsewhere in the spreadsheet move the marker without changing the rows. The sync keeps the
+            # current marker itself, the file keeps the one the version was downloaded at and is not rewritten
+            return None
+
+        seq = self.seqs[-1] + 1 if self.seqs else 1
+        version = {'seq': seq, 'time': time.time(), 'marker': marker, 'digest': digest, 'rows': rows}
+        self._write(version)
+        self.seqs.append(seq)
+        for old_seq in self.seqs[:-self.keep]:
+            try:
+                os.remove(self._path(old_seq))
+            except FileNotFoundError:
+                pass
+        del self.seqs[:-self.keep]
+        self._latest = version
+
+        diff = diff_rows(latest['rows'] if latest is not None else [], rows)
+        diff['from'] = latest['seq'] if latest is not None else None
+        diff['to'] = seq
+        return version, diff
+
+    # What changed between two stored versions
+    def diff(self, old_seq, new_seq):
+        diff = diff_rows(self.get(old_seq)['rows'], self.get(new_seq)['rows'])
+        diff['from'] = old_seq
+        diff['to'] = new_seq
+        return diff
+
+
+if __name__ == '__main__':
+    versions = SheetVersions(sys.argv[1])
+    for seq in versions.seqs:
+        version = versions.get(seq)
+        stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(version['time']))
+        print(f"{seq} {stamp} {len(version['rows'])} rows, marker {version['marker']}, {version['digest'][:12]}")
+    if len(versions.seqs) > 1:
+        diff = versions.diff(versions.seqs[-2], versions.seqs[-1])
+        for name in ('granted', 'revoked', 'added', 'removed'):
+            print(f"{name}: {' '.join(diff[name]) or '-'}")
@@ -0,0 +1,186 @@
+"""
+Shared Google Sheets access for the doors, the enrollment tools, the updater
+and the hub.
+
+SheetsClient talks to the Sheets REST API through one google.auth
+AuthorizedSession, so every request reuses the same pooled keep-alive HTTPS
+connections and no discovery document is needed. Every request has a timeout.
+Failures that are worth another try (connection errors, timeouts, 429 and 5xx)
+are retried with exponential backoff and jitter, up to retries times, before
+a SheetsError is raised. Appends are not idempotent, so they are only retried
+when nothing can have been written: a connect timeout, 429 or 503.
+
+The OAuth access token is cached in token_cache (mode 600) until it expires,
+so a restarted script skips the token exchange. Reads ask for unformatted
+values and, through the fields parameter, only the values themselves. Cells
+always come back as strings, like the old values().get() calls.
+
+file_version() asks Drive for the spreadsheet's version number, a few bytes
+that change with every edit, so a sync can skip the download when nothing
+changed. It needs the Drive API enabled in the Cloud project.
+
+google.auth is imported on the first request, so creating a client costs
+nothing at startup.
+"""
+
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from urllib.parse import quote
+
+from nfc_door.atomic_file import atomic_write
+
+API = 'https://sheets.googleapis.com/v4/spreadsheets'
+DRIVE_API = 'https://www.googleapis.com/drive/v3/files'
+SCOPES = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive.metadata.readonly']
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+APPEND_RETRY_STATUS = {429, 503}
+DEFAULT_TAB = 'Sheet1'  # First tab of a new spreadsheet
+
+
+# Name of the access sheet's tab from the [google_api] settings, DEFAULT_TAB when RANGE is missing or empty
+def sheet_tab(settings):
+    return (settings.get('RANGE') or '').strip() or DEFAULT_TAB
+
+
+class SheetsError(RuntimeError):
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status  # HTTP status, None when no answer came back
+
+
+class SheetsClient:
+    def __init__(self, service_account_file, sheet_id, token_cache=None, timeout=10,
+                 retries=5, base_delay=0.5, max_delay=30):
+        self.service_account_file = service_account_file
+        self.sheet_id = sheet_id
+        self.token_cache = token_cache
+        self.timeout = timeout
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.requests = 0
+        self.retried = 0
+        self._session = None
+        self._saved_token = None
+        self._lock = threading.Lock()
+
+    def _get_session(self):
+        with self._lock:
+            if self._session is None:
+                from google.auth.transport.requests import AuthorizedSession
+                from google.oauth2 import service_account
+
+                creds = service_account.Credentials.from_service_account_file(
+                    self.service_account_file, scopes=SCOPES)
+                self._load_token(creds)
+                self._session = AuthorizedSession(creds)
+            return self._session
+
+    # Put a cached token that is still valid into the credentials
+    def _load_token(self, creds):
+        if not self.token_cache:
+            return
+        try:
+            with open(self.token_cache) as f:
+                cached = json.load(f)
+            token, expiry = cached['token'], cached['expiry']
+        except (OSError, ValueError, KeyError):
+            return
+        # A token from before a scope was added would be refused for it
+        if expiry > time.time() + 60 and cached.get('scopes') == SCOPES:
+            # google.auth keeps expiry as a naive UTC datetime
+            creds.token = token
+            creds.expiry = datetime(1970, 1, 1) + timedelta(seconds=expiry)
+            self._saved_token = token
+
+    def _save_token(self):
+        creds = self._session.credentials
+        if not self.token_cache or not creds.token or creds.expiry is None or creds.token == self._saved_token:
+            return
+        cached = {'token': creds.token, 'expiry': (creds.expiry - datetime(1970, 1, 1)).total_seconds(), 'scopes': SCOPES}
+        self._saved_token = creds.token
+        try:
+            atomic_write(self.token_cache, json.dumps(cached), permissions=0o600)  # Only readable by this user
+        except OSError as e:
+            print(f'Error caching the Google token: {e}')
+
+    # Seconds to wait before the given retry, doubling each time with up to half of it taken off at random
+    def _backoff(self, attempt):
+        delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+        return delay * random.uniform(0.5, 1)
+
+    def _request(self, method, path, params=None, body=None, retry_status=RETRY_STATUS, api=API):
+        import requests
+        from google.auth.exceptions import RefreshError, TransportError
+
+        session = self._get_session()
+        url = f'{api}/{self.sheet_id}{path}'
+        attempt = 0
+        while True:
+            self.requests += 1
+            try:
+                response = session.request(method, url, params=params, json=body, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                # Once connected it is unknown whether an append got through, so it only retries failed connects
+                unsafe = retry_status is APPEND_RETRY_STATUS and not isinstance(e, requests.ConnectTimeout)
+                if unsafe or attempt >= self.retries:
+                    raise SheetsError(f'Google Sheets request failed: {e}') from e
+            except (RefreshError, TransportError) as e:
+                # The token is refreshed before the request is sent, so this is safe to retry even for an append
+                if attempt >= self.retries:
+                    raise SheetsError(f'Google login failed: {e}') from e
+            else:
+                if response.status_code < 400:
+                    self._save_token()
+                    return response.json()
+                if response.status_code not in retry_status or attempt >= self.retries:
+                    raise SheetsError(f'Google Sheets answered {response.status_code}: {response.text[:200]}',
+                                      response.status_code)
+            self.retried += 1
+            time.sleep(self._backoff(attempt))
+            attempt += 1
+
+    # Rows of a range as lists of strings, e.g. get_values('Sheet1!A:B')
+    def get_values(self, cell_range):
+        params = {'valueRenderOption': 'UNFORMATTED_VALUE', 'fields': 'values'}
+        result = self._request('GET', f'/values/{quote(cell_range, safe="")}', params=params)
+        return _as_strings(result.get('values', []))
+
+    # Rows of several ranges in one request, one list of rows per range
+    def batch_get(self, cell_ranges):
+        params = {'ranges': list(cell_ranges), 'valueRenderOption': 'UNFORMATTED_VALUE', 'fields': 'valueRanges(values)'}
+        result = self._request('GET', '/values:batchGet', params=params)
+        return [_as_strings(value_range.get('values', [])) for value_range in result.get('valueRanges', [])]
+
+    # Add rows below the table in a range
+    def append(self, cell_range, rows, value_input='USER_ENTERED'):
+        params = {'valueInputOption': value_input, 'insertDataOption': 'INSERT_ROWS', 'fields': 'updates(updatedRange)'}
+        return self._request('POST', f'/values/{quote(cell_range, safe="")}:append', params=params,
+                             body={'values': rows}, retry_status=APPEND_RETRY_STATUS)
+
+    # Write several ranges in one request, data is a list of {'range': ..., 'values': [...]}
+    def batch_update(self, data, value_input='USER_ENTERED'):
+        body = {'valueInputOption': value_input, 'data': data}
+        return self._request('POST', '/values:batchUpdate', params={'fields': 'totalUpdatedCells'}, body=body)
+
+    # Drive's version number of the spreadsheet, it goes up with every edit anywhere in it
+    def file_version(self):
+        result = self._request('GET', '', params={'fields': 'version', 'supportsAllDrives': 'true'}, api=DRIVE_API)
+        return result['version']
+
+
+def _as_strings(rows):
+    return [[value if isinstance(value, str) else _number_text(value) for value in row] for row in rows]
+
+
+# 1234.0 comes back for a cell showing 1234, give the text the sheet shows
+def _number_text(value):
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
@@ -0,0 +1,49 @@
+"""
+Tag presence tracking.
+
+A tag left on the reader is read again on every loop, and each read used to be
+looked up and granted again, with another relay pulse each time. The tracker
+remembers when each UID was last read and turns the raw reads into events:
+'arrived' the first time a UID is seen, 'present' while it keeps being read,
+and 'departed' once it has not been read for the hold-off window. Only
+arrivals need to be authorized.
+"""
+
+import time
+
+TAG_ARRIVED = 'arrived'
+TAG_PRESENT = 'present'
+TAG_DEPARTED = 'departed'
+
+
+class PresenceTracker:
+    def __init__(self, hold_off=1.5):
+        self.hold_off = hold_off  # Seconds a tag may go unread before it counts as removed
+        self._last_seen = {}
+
+    # Feed the result of one read (a UID or None) and get back a list of (event, uid bytes)
+    def update(self, uid, now=None):
+        if now is None:
+            now = time.monotonic()
+        key = bytes(uid) if uid is not None else None
+
+        events = []
+        for seen_key, seen_at in list(self._last_seen.items()):
+            if seen_key != key and now - seen_at > self.hold_off:
+                del self._last_seen[seen_key]
+                events.append((TAG_DEPARTED, seen_key))
+        if key is not None:
+            events.append((TAG_PRESENT if key in self._last_seen else TAG_ARRIVED, key))
+            self._last_seen[key] = now
+        return events
+
+    # UID bytes of the tag that just arrived in a list of events, or None
+    @staticmethod
+    def arrival(events):
+        for event, key in events:
+            if event == TAG_ARRIVED:
+                return key
+        return None
+
+    def __contains__(self, uid):
+        return bytes(uid) in self._last_seen
@@ -0,0 +1,106 @@
+"""
+Per-tap latency traces.
+
+Each tap gets a TapTrace that records time.monotonic() when the read finished,
+the lookup finished, the decision was made, the relay switched on and the LEDs
+were updated. Finished traces are written as one JSON object per line by
+TraceWriter, which buffers them and writes from a background thread, and
+rotates the file once it grows past max_bytes. Times in the file are
+milliseconds after read_complete, so tap-to-unlock percentiles per door are
+just the relay_on column.
+"""
+
+import json
+import os
+import threading
+import time
+
+READ_COMPLETE = 'read_complete'
+LOOKUP_COMPLETE = 'lookup_complete'
+DECISION = 'decision'
+RELAY_ON = 'relay_on'
+LED_UPDATE = 'led_update'
+
+
+class TapTrace:
+    def __init__(self, uid, door='', read_complete=None):
+        self.uid = bytes(uid)
+        self.door = door
+        self.wall_time = time.time()
+        self.decision = None
+        self.marks = {READ_COMPLETE: read_complete if read_complete is not None else time.monotonic()}
+
+    def mark(self, name, at=None):
+        if name not in self.marks:
+            self.marks[name] = at if at is not None else time.monotonic()
+
+    def has(self, name):
+        return name in self.marks
+
+    # Seconds since the read finished
+    def age(self):
+        return time.monotonic() - self.marks[READ_COMPLETE]
+
+    def to_record(self):
+        start = self.marks[READ_COMPLETE]
+        record = {
+            'time': round(self.wall_time, 3),
+            'door': self.door,
+            'uid': self.uid.hex(),
+            'decision': self.decision,
+        }
+        for name, at in self.marks.items():
+            record[f'{name}_ms'] = round((at - start) * 1000, 3)
+        return record
+
+
+class TraceWriter:
+    def __init__(self, path, max_bytes=5 * 1024 * 1024, backup_count=3, flush_interval=2.0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.flush_interval = flush_interval
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='trace writer', daemon=True)
+        self._thread.start()
+
+    # Queue a finished trace, only appends to a list
+    def write(self, trace):
+        line = json.dumps(trace.to_record(), separators=(',', ':')) + '\n'
+        with self._lock:
+            self._buffer.append(line)
+
+    def flush(self):
+        with self._lock:
+            lines, self._buffer = self._buffer, []
+        if not lines:
+            return
+        try:
+            self._rotate_if_needed()
+            with open(self.path, 'a') as f:
+                f.writelines(lines)
+        except OSError as e:
+            print(f'Error writing tap traces: {e}')
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        self.flush()
+
+    # Move path to path.1, path.1 to path.2 and so on once the file is too big
+    def _rotate_if_needed(self):
+        try:
+            if os.path.getsize(self.path) < self.max_bytes:
+                return
+        except OSError:
+            return
+        for i in range(self.backup_count - 1, 0, -1):
+            if os.path.exists(f'{self.path}.{i}'):
+                os.replace(f'{self.path}.{i}', f'{self.path}.{i + 1}')
+        os.replace(self.path, f'{self.path}.1')
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
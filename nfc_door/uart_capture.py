@@ -0,0 +1,215 @@
+"""
+Record and replay the serial traffic between the Pi and the PN532.
+
+RecordingSerial wraps the serial.Serial given to PN532_UART and logs every
+write, every non-empty read and every input buffer flush with a timestamp.
+ReplaySerial plays a capture back to PN532_UART without hardware. The bytes
+read after the Nth write in the capture are released after the Nth write in
+the replay, with the recorded delays divided by speed. Request and response
+therefore stay lined up however fast the code under test runs.
+
+Capture file layout: b'PNCAP1' then records of kind (1 byte: W, R or F),
+microseconds since the previous record (u32), length (u16) and the bytes.
+
+    python3 -m nfc_door.uart_capture capture.bin    # summary and frame errors
+"""
+
+import array
+import fcntl
+import os
+import select
+import struct
+import sys
+import termios
+import threading
+import time
+
+MAGIC = b'PNCAP1'
+RECORD = struct.Struct('<cIH')
+
+WRITE = b'W'
+READ = b'R'
+FLUSH = b'F'
+
+
+class RecordingSerial:
+    def __init__(self, serial, path):
+        self._serial = serial
+        self._file = open(path, 'wb')
+        self._file.write(MAGIC)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _record(self, kind, data=b''):
+        with self._lock:
+            now = time.monotonic()
+            delta = min(int((now - self._last) * 1e6), 0xFFFFFFFF)
+            self._last = now
+            for start in range(0, max(len(data), 1), 0xFFFF):
+                chunk = bytes(data[start:start + 0xFFFF])
+                self._file.write(RECORD.pack(kind, delta, len(chunk)) + chunk)
+                delta = 0
+
+    def write(self, data):
+        self._record(WRITE, data)
+        return self._serial.write(data)
+
+    def read(self, size=1):
+        data = self._serial.read(size)
+        if data:
+            self._record(READ, data)
+        return data
+
+    def reset_input_buffer(self):
+        self._record(FLUSH)
+        self._serial.reset_input_buffer()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+        self._serial.close()
+
+    # Everything else (in_waiting, fileno, timeout, ...) goes to the real port
+    def __getattr__(self, name):
+        return getattr(self._serial, name)
+
+
+# Read a capture file into a list of (kind, seconds since previous record, bytes)
+def load_capture(path):
+    records = []
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'{path} is not a PN532 UART capture')
+        while True:
+            header = f.read(RECORD.size)
+            if len(header) < RECORD.size:
+                break
+            kind, delta, length = RECORD.unpack(header)
+            records.append((kind, delta / 1e6, f.read(length)))
+    return records
+
+
+class ReplaySerial:
+    def __init__(self, path, speed=1.0, timeout=0.1):
+        self.timeout = timeout
+        self.speed = speed  # 0 releases every response immediately
+        self.writes = 0
+        self.mismatched_writes = 0  # Writes that differ from the capture, the replay may have drifted
+        self._segments, self._expected_writes = self._split(load_capture(path))
+        self._read_fd, self._write_fd = os.pipe()
+        self._released = threading.Condition()
+        self._stop = False
+        self._feeder = threading.Thread(target=self._feed, name='uart replay', daemon=True)
+        self._feeder.start()
+
+    # Group the reads by the write they followed: segment N holds the reads after write N
+    @staticmethod
+    def _split(records):
+        segments = [[]]
+        writes = []
+        delay = 0.0
+        for kind, delta, data in records:
+            delay += delta
+            if kind == WRITE:
+                writes.append(data)
+                segments.append([])
+                delay = 0.0
+            elif kind == READ:
+                segments[-1].append((delay, data))
+        return segments, writes
+
+    def _feed(self):
+        for index, segment in enumerate(self._segments):
+            with self._released:
+                self._released.wait_for(lambda: self._stop or self.writes >= index)
+                if self._stop:
+                    return
+                released_at = time.monotonic()
+            for delay, data in segment:
+                if self.speed:
+                    wait = released_at + delay / self.speed - time.monotonic()
+                    if wait > 0:
+                        time.sleep(wait)
+                try:
+                    os.write(self._write_fd, data)
+                except OSError:
+                    return  # Closed while replaying
+
+    def write(self, data):
+        if self.writes < len(self._expected_writes) and bytes(data) != self._expected_writes[self.writes]:
+            self.mismatched_writes += 1
+        with self._released:
+            self.writes += 1
+            self._released.notify_all()
+        return len(data)
+
+    @property
+    def in_waiting(self):
+        count = array.array('i', [0])
+        fcntl.ioctl(self._read_fd, termios.FIONREAD, count)
+        return count[0]
+
+    # Same as pyserial: wait until size bytes arrived or the timeout passed
+    def read(self, size=1):
+        deadline = time.monotonic() + (self.timeout or 0)
+        data = b''
+        while len(data) < size:
+            remaining = deadline - time.monotonic()
+            readable, _, _ = select.select([self._read_fd], [], [], max(0.0, remaining))
+            if not readable:
+                break
+            data += os.read(self._read_fd, size - len(data))
+        return data
+
+    def reset_input_buffer(self):
+        while self.in_waiting:
+            os.read(self._read_fd, self.in_waiting)
+
+    def fileno(self):
+        return self._read_fd
+
+    # True once every recorded response has been handed out
+    def finished(self):
+        return not self._feeder.is_alive()
+
+    def close(self):
+        with self._released:
+            self._stop = True
+            self._released.notify_all()
+        os.close(self._write_fd)
+        os.close(self._read_fd)
+
+
+# Count PN532 frames in a byte stream and the ones with a bad length or data checksum
+def check_frames(stream):
+    frames = bad_length = bad_data = 0
+    i = stream.find(b'\x00\xff')
+    while i >= 0 and i + 4 <= len(stream):
+        length, lcs = stream[i + 2], stream[i + 3]
+        following = i + 2
+        if length == 0 and lcs == 0xFF:
+            following = i + 4  # ACK frame
+        elif (length + lcs) & 0xFF:
+            bad_length += 1
+        elif i + 5 + length <= len(stream):
+            frames += 1
+            if (sum(stream[i + 4:i + 4 + length]) + stream[i + 4 + length]) & 0xFF:
+                bad_data += 1
+            following = i + 5 + length
+        i = stream.find(b'\x00\xff', following)
+    return frames, bad_length, bad_data
+
+
+def main(path):
+    records = load_capture(path)
+    duration = sum(delta for _, delta, _ in records)
+    reads = b''.join(data for kind, _, data in records if kind == READ)
+    counts = {kind: sum(1 for k, _, _ in records if k == kind) for kind in (WRITE, READ, FLUSH)}
+    frames, bad_length, bad_data = check_frames(reads)
+    print(f'{path}: {duration:.1f} s, {counts[WRITE]} writes, {counts[READ]} reads '
+          f'({len(reads)} bytes), {counts[FLUSH]} input flushes')
+    print(f'PN532 frames: {frames}, bad length checksum: {bad_length}, bad data checksum: {bad_data}')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1])
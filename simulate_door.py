@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Run the asyncio door loop headless with a simulated PN532, relay and LED strip.
+
+Example:
+    python3 simulate_door.py --sheet local_verification_sheet.csv \\
+        --tag 1:ab12cd34 --tag 3:01020304:0.5 --error "2:Did not receive expected ACK from PN532!"
+
+--tag is SECONDS:UID[:HOLD] and --error is SECONDS:MESSAGE.
+
+With --replay the real PN532 driver runs against a UART capture recorded by a
+door (UART_CAPTURE in settings.toml) instead of the simulated reader; this
+needs adafruit_pn532 installed but no hardware:
+    python3 simulate_door.py --replay capture.bin --speed 10
+"""
+
+import argparse
+import asyncio
+import time
+
+from nfc_door.credential_index import CredentialIndex
+from nfc_door.door_controller import DoorController
+from nfc_door.hardware import SimulatedReader, SimulatedRelay, SimulatedPixels, open_pn532_on
+from nfc_door.uart_capture import ReplaySerial
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Run the door loop against simulated hardware')
+    parser.add_argument('--sheet', default='local_verification_sheet.csv', help='local verification sheet to authorize against')
+    parser.add_argument('--tag', action='append', default=[], help='SECONDS:UID[:HOLD], put a tag on the reader')
+    parser.add_argument('--error', action='append', default=[], help='SECONDS:MESSAGE, make a read fail')
+    parser.add_argument('--unlock-seconds', type=float, default=5)
+    parser.add_argument('--replay', help='UART capture to feed the real PN532 driver')
+    parser.add_argument('--speed', type=float, default=1, help='replay speed factor, 0 for as fast as possible')
+    parser.add_argument('--no-autopoll', action='store_true', help='the capture was recorded without InAutoPoll')
+    return parser.parse_args()
+
+
+async def run(controller, finished):
+    door = asyncio.create_task(controller.run())
+    # Stop once every tag has been presented and the door has closed again
+    while not door.done() and (not finished() or controller.relay.is_open):
+        await asyncio.sleep(0.1)
+    door.cancel()
+    try:
+        await door
+    except asyncio.CancelledError:
+        pass
+
+
+def simulated_reader(args):
+    reader = SimulatedReader()
+    for tag in args.tag:
+        at, uid, *hold = tag.split(':')
+        reader.add_tag(uid, float(at), float(hold[0]) if hold else 0.3)
+    for error in args.error:
+        at, message = error.split(':', 1)
+        reader.add_error(message, float(at))
+    return reader, None
+
+
+def main():
+    args = parse_args()
+    if args.replay:
+        uart = ReplaySerial(args.replay, speed=args.speed)
+        reader, _ = open_pn532_on(uart, autopoll=not args.no_autopoll)
+        finished = uart.finished
+    else:
+        reader, uart = simulated_reader(args)
+        finished = reader.finished
+
+    relay = SimulatedRelay()
+    pixels = SimulatedPixels(verbose=True)
+    controller = DoorController(reader, CredentialIndex(args.sheet), relay, pixels,
+                                lambda subject, body: print(f'Email: {subject}'), uart=uart,
+                                door_location='Simulated', unlock_seconds=args.unlock_seconds)
+    start = time.monotonic()
+    asyncio.run(run(controller, finished))
+    wall = time.monotonic() - start
+
+    print('Relay:', ', '.join(f'{"on" if on else "off"} at {at - start:.3f}s' for at, on in relay.transitions))
+    print('Reader faults:', dict(controller.faults.counts))
+    if args.replay:
+        print(f'Replayed {uart.writes} writes in {wall:.2f}s, {uart.mismatched_writes} differed from the capture')
+        uart.close()
+
+
+if __name__ == '__main__':
+    main()